@@ -1,68 +1,48 @@
  # interface.py
+import logging
 import os
 import gradio as gr
-from crewai import Crew, Process
-from agents import finance_knowledge_agent, market_news_agent, stock_analysis_agent, response_refiner_agent
-from tasks import get_finance_knowledge_task, get_market_news_task, get_stock_analysis_task, get_response_refiner_task
-from utils import determine_question_type, search_qdrant
+# serve must be imported before pipeline: in multi-worker mode it points the answer cache at a shared file
+from serve import SERVE_WORKERS, WorkerPool, limit_quotas, stream_answer
+from pipeline import FinancePipeline, PIPELINE_WORKERS, STREAMING
+from utils import start_warm_up
+from tracing import start_metrics_server
+from ticker import ticker_refresher, TICKER_UI_INTERVAL
+
+# Surface the pipeline's latency log lines
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
 
 # Set CrewAI storage directory to something writable
 os.environ["CREWAI_STORAGE_DIR"] = "/tmp/crewai"
 
-# Initialize Crew 
-finance_crew = Crew(
-    agents=[finance_knowledge_agent, market_news_agent, stock_analysis_agent, response_refiner_agent],
-    tasks=[],
-    process=Process.sequential,
-    verbose=1 
-)
+# Shared pipeline; each request gets its own isolated crew
+pipeline = FinancePipeline(max_workers=PIPELINE_WORKERS, verbose=1)
 
-def get_response(query):
-    """Get chatbot response."""
-    finance_crew.tasks = []  # Reset tasks for each query
+# With SERVE_WORKERS > 1 queries are answered by pre-forked worker processes instead. They
+# are forked here, before the UI starts any threads; this process keeps one quota share
+# for the ticker tape.
+worker_pool = None
+if SERVE_WORKERS > 1:
+    worker_pool = WorkerPool(SERVE_WORKERS, quota_shares=SERVE_WORKERS + 1).start().supervise()
+    limit_quotas(SERVE_WORKERS + 1)
 
-    try:
-        question_type, processed_query = determine_question_type(query)
+def answer_stream(query):
+    if worker_pool is not None:
+        return stream_answer(worker_pool.url, query)
+    return pipeline.stream(query)
 
-        # Determine RAG usage
-        rag_note = "RAG_SUFFICIENT"  # Default for finance_knowledge
-        if question_type == "finance_knowledge":
-            contexts = search_qdrant(query, top_k=2)
-            if contexts and len(contexts) > 0:
-                shortened_contexts = []
-                for ctx in contexts:
-                    text = ctx["text"]
-                    if len(text) > 300: 
-                        text = text[:297] + "..."
-                    shortened_contexts.append({
-                        "source": ctx["source"],
-                        "text": text
-                    })
-                context_text = "\n\n".join([f"Source: {ctx['source']}\nContent: {ctx['text']}" for ctx in shortened_contexts])
-                is_context_useful = len(context_text) > 30 and any(keyword in context_text.lower() for keyword in query.lower().split())
-                rag_note = "RAG_SUFFICIENT" if is_context_useful else "RAG_NOT_USED"
-            else:
-                rag_note = "RAG_NOT_USED"
-            initial_task = get_finance_knowledge_task(query)
-        elif question_type == "market_news":
-            rag_note = "NO_RAG_NEEDED"
-            initial_task = get_market_news_task(query)
-        elif question_type == "stock_analysis":
-            rag_note = "NO_RAG_NEEDED"
-            initial_task = get_stock_analysis_task(processed_query)
+def get_response(query):
+    """Get chatbot response, streaming stage progress and report tokens when STREAMING is on."""
+    try:
+        if STREAMING:
+            yield from answer_stream(query)
+        elif worker_pool is not None:
+            *_, report = stream_answer(worker_pool.url, query)
+            yield report
         else:
-            initial_task = get_finance_knowledge_task(query)
-
-        finance_crew.tasks.append(initial_task)
-        initial_response = finance_crew.kickoff()
-
-        refiner_task = get_response_refiner_task(query, initial_response, question_type, rag_note=rag_note)
-        finance_crew.tasks = [refiner_task]
-        final_report = finance_crew.kickoff()
-
-        return final_report
+            yield pipeline.run(query)
     except Exception as e:
-        return f"Error: {e}\nPlease try again."
+        yield f"Error: {e}\nPlease try again."
 
 # CSS
 custom_css = """
@@ -213,21 +193,6 @@ custom_css = """
 """
 
 # HTML components for design
-ticker_html = """
-<div class="ticker-tape">
-    <div class="ticker-content">
-        <span class="stock-symbol">AAPL <span class="up">+1.2%</span></span>
-        <span class="stock-symbol">MSFT <span class="up">+0.8%</span></span>
-        <span class="stock-symbol">GOOGL <span class="down">-0.4%</span></span>
-        <span class="stock-symbol">AMZN <span class="up">+2.1%</span></span>
-        <span class="stock-symbol">TSLA <span class="down">-1.7%</span></span>
-        <span class="stock-symbol">JPM <span class="up">+0.5%</span></span>
-        <span class="stock-symbol">BAC <span class="down">-0.2%</span></span>
-        <span class="stock-symbol">WMT <span class="up">+0.3%</span></span>
-    </div>
-</div>
-"""
-
 finance_icons = """
 <div class="finance-icons">
     <span style="color: #4CAF50;">📊 📈 💹 💰 📉 🏦 📃 </span>
@@ -240,7 +205,9 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Base(), analytics_enabled=False)
     gr.HTML("<h3>Your AI-powered financial advisor and market analyst</h3>")
     
     gr.HTML(finance_icons)
-    gr.HTML(ticker_html)
+    # Live ticker tape, re-rendered from the shared refresher's snapshot
+    ticker = gr.HTML(ticker_refresher.render_html)
+    gr.Timer(TICKER_UI_INTERVAL).tick(fn=ticker_refresher.render_html, outputs=ticker, show_progress="hidden")
     
     with gr.Row():
         with gr.Column(scale=1):
@@ -266,5 +233,13 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Base(), analytics_enabled=False)
     # Event handlers
     submit_btn.click(fn=get_response, inputs=input_text, outputs=output_text)
 
-# Launch the interface
-interface.launch(share=False, inbrowser=True)
\ No newline at end of file
+# Launch the interface; requests no longer share state, so let the queue run them in parallel
+interface.queue(default_concurrency_limit=PIPELINE_WORKERS)
+interface.launch(share=False, inbrowser=True, prevent_thread_lock=True)
+
+# Load models and connect upstreams in the background once the UI is already serving
+if worker_pool is None:
+    start_warm_up()
+ticker_refresher.start()
+start_metrics_server()
+interface.block_thread()
\ No newline at end of file
@@ -0,0 +1,150 @@
+# batch.py
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import normalize_query
+
+def query_id(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()[:16]
+
+def read_queries(path):
+    """Read queries from JSONL and collapse duplicates.
+
+    Each line is a JSON object with a "query" and an optional "id", or a bare JSON string.
+    Queries that are equal after normalization are answered once; the result lists the ids
+    of every input line that asked it. Returns a list of {"key", "query", "ids"} in input order.
+    """
+    unique = {}
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"query": record}
+            query = normalize_query(record["query"])
+            key = query_id(query)
+            entry = unique.setdefault(key, {"key": key, "query": query, "ids": []})
+            entry["ids"].append(record.get("id", line_number))
+    return list(unique.values())
+
+def completed_keys(path):
+    """Keys already answered successfully in an existing results file (the checkpoint)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            if result.get("error") is None:
+                done.add(result["key"])
+            else:
+                done.discard(result["key"])
+    return done
+
+class ResultWriter:
+    """Appends one JSON line per finished query and syncs it to disk, so the results file
+    doubles as the checkpoint of a run."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def answer(pipeline, entry, submitted):
+    started = time.perf_counter()
+    result = {"key": entry["key"], "ids": entry["ids"], "query": entry["query"]}
+    try:
+        result["report"] = str(pipeline.run(entry["query"]))
+        result["error"] = None
+    except Exception as e:
+        result["report"] = None
+        result["error"] = f"{type(e).__name__}: {e}"
+    finished = time.perf_counter()
+    result["timings"] = {"queued_seconds": round(started - submitted, 3), "seconds": round(finished - started, 3)}
+    result["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return result
+
+def apply_rate_limits(args):
+    """Install the per-upstream quotas for this run."""
+    from http_client import set_rate_limit
+    from quote_service import quote_service, history_service, set_alpha_vantage_rate
+    from tasks import set_stock_deadline
+    from utils import STOCK_DEADLINE
+
+    for upstream in ("serper", "gemini", "mistral"):
+        rate = getattr(args, f"{upstream}_rate")
+        if rate is not None:
+            set_rate_limit(upstream, rate)
+    if args.alpha_vantage_rate is not None:
+        set_alpha_vantage_rate(args.alpha_vantage_rate)
+    # Unattended runs wait for a quote token instead of answering from a stale or missing quote;
+    # the fetch deadline covers that wait plus the request itself, so the wait is not cut short
+    quote_service.max_wait = history_service.max_wait = args.quote_wait
+    set_stock_deadline(args.quote_wait + STOCK_DEADLINE)
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of queries and write the reports as JSONL.")
+    parser.add_argument("input", help='JSONL with one {"id": ..., "query": ...} object (or string) per line.')
+    parser.add_argument("output", help="Results JSONL; re-running with the same file resumes where it stopped.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Queries answered in parallel.")
+    parser.add_argument("--serper-rate", type=float, help="Serper calls per minute.")
+    parser.add_argument("--gemini-rate", type=float, help="Gemini calls per minute.")
+    parser.add_argument("--mistral-rate", type=float, help="Mistral calls per minute.")
+    parser.add_argument("--alpha-vantage-rate", type=float, help="Alpha Vantage calls per minute.")
+    parser.add_argument("--quote-wait", type=float, default=120.0, help="Seconds a query may wait for a quote token.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the semantic answer cache.")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Bypass the persistent LLM response cache.")
+    args = parser.parse_args()
+
+    from pipeline import FinancePipeline, answer_cache
+    from llm_cache import llm_cache
+
+    apply_rate_limits(args)
+    if args.no_llm_cache and llm_cache is not None:
+        llm_cache.enabled = False
+    entries = read_queries(args.input)
+    done = completed_keys(args.output)
+    pending = [entry for entry in entries if entry["key"] not in done]
+    print(f"{len(entries)} unique queries, {len(entries) - len(pending)} already done, {len(pending)} to run.")
+
+    pipeline = FinancePipeline(max_workers=args.concurrency, verbose=False, cache=None if args.no_cache else answer_cache)
+    writer = ResultWriter(args.output)
+    start = time.perf_counter()
+    failures = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch") as pool:
+            submitted = time.perf_counter()
+            futures = [pool.submit(answer, pipeline, entry, submitted) for entry in pending]
+            for finished, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                writer.write(result)
+                failures += result["error"] is not None
+                print(f"[{finished}/{len(pending)}] {result['timings']['seconds']:.1f}s "
+                      f"{'FAILED ' if result['error'] else ''}{result['query'][:70]}")
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"Finished {len(pending)} queries in {elapsed:.1f}s with {failures} failures; "
+          f"re-run the same command to retry failed queries.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+# benchmark.py
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_QUERIES = [
+    "What is the difference between bull and bear markets?",
+    "Analyze AAPL stock performance",
+    "Latest news about cryptocurrency market",
+    "Explain P/E ratio and its importance",
+]
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def run_load(run_query, queries, workers):
+    """Push every query through `run_query` on `workers` threads and collect timings."""
+    latencies = []
+    errors = 0
+
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            run_query(query)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for latency, error in pool.map(timed, queries):
+            latencies.append(latency)
+            errors += error is not None
+    elapsed = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "requests": len(queries),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(queries) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+    }
+
+def print_results(results):
+    print(f"{'workers':>8} {'requests':>9} {'errors':>7} {'elapsed s':>10} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'speedup':>8}")
+    base = results[0]["throughput"] if results else 0.0
+    for r in results:
+        speedup = r["throughput"] / base if base else 0.0
+        print(f"{r['workers']:>8} {r['requests']:>9} {r['errors']:>7} {r['elapsed']:>10.2f} "
+              f"{r['throughput']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f} {speedup:>7.2f}x")
+
+def load_test(args):
+    """Measure pipeline throughput as the number of concurrent workers grows."""
+    from pipeline import FinancePipeline
+    from llm_cache import llm_cache
+
+    # Repeated queries would otherwise be answered from the LLM cache after the first run
+    if llm_cache is not None:
+        llm_cache.enabled = False
+    queries = (DEFAULT_QUERIES * args.requests)[:args.requests]
+    results = []
+    for workers in args.workers:
+        pipeline = FinancePipeline(max_workers=workers, verbose=False, cache=None)
+        results.append(run_load(pipeline.run, queries, workers))
+    print_results(results)
+
+# Runs in a fresh interpreter so module caches and loaded models start cold
+STARTUP_PROBE = """
+import json, time
+start = time.perf_counter()
+import pipeline
+timings = {{"import": time.perf_counter() - start}}
+if {warm}:
+    from utils import warm_up
+    start = time.perf_counter()
+    warm_up()
+    timings["warm_up"] = time.perf_counter() - start
+start = time.perf_counter()
+pipeline.FinancePipeline(verbose=False, cache=None).run({query!r})
+timings["first_answer"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+def startup_benchmark(args):
+    """Report cold import time and time to first answer, with and without an explicit warm-up."""
+    print(f"{'mode':>10} {'import s':>9} {'warm-up s':>10} {'first answer s':>15}")
+    for warm in (False, True):
+        samples = []
+        for _ in range(args.runs):
+            probe = STARTUP_PROBE.format(warm=warm, query=args.query)
+            output = subprocess.run(
+                [sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)), env=dict(os.environ, LLM_CACHE_BYPASS="true")
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        mean = lambda key: sum(s.get(key, 0.0) for s in samples) / len(samples)
+        print(f"{'warm-up' if warm else 'lazy':>10} {mean('import'):>9.2f} {mean('warm_up'):>10.2f} {mean('first_answer'):>15.2f}")
+
+STAGES = ("classify", "retrieve", "analyze", "report", "first_token", "total")
+
+def stage_timings(pipeline, query, stage_messages):
+    """Consume one streamed answer and split its wall time into stages.
+
+    The progress lines the pipeline yields mark stage boundaries; anything else is report
+    text. In fused mode "analyze" includes writing the report.
+    """
+    stage_by_text = {text: name for name, text in stage_messages.items()}
+    marks = {"start": time.perf_counter()}
+    for text in pipeline.stream(query):
+        name = stage_by_text.get(text, "first_token")
+        marks.setdefault(name, time.perf_counter())
+    marks["end"] = time.perf_counter()
+
+    spans = {
+        "classify": ("classifying", "retrieving"),
+        "retrieve": ("retrieving", "analyzing"),
+        "analyze": ("analyzing", "reporting" if "reporting" in marks else "end"),
+        "report": ("reporting", "end"),
+        "first_token": ("start", "first_token"),
+        "total": ("start", "end"),
+    }
+    return {stage: marks[end] - marks[begin] for stage, (begin, end) in spans.items() if begin in marks and end in marks}
+
+def run_offline_level(pipeline, queries, workers, stage_messages):
+    """Answer every query on `workers` threads; return per-stage percentiles and throughput."""
+    samples = {stage: [] for stage in STAGES}
+    errors = 0
+
+    def timed(query):
+        try:
+            return stage_timings(pipeline, query, stage_messages)
+        except Exception:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for timings in pool.map(timed, queries):
+            if timings is None:
+                errors += 1
+                continue
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+    elapsed = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "requests": len(queries),
+        "errors": errors,
+        "rps": len(queries) / elapsed if elapsed else 0.0,
+        "stages": {
+            stage: {f"p{pct}": percentile(values, pct) for pct in (50, 95, 99)}
+            for stage, values in samples.items() if values
+        },
+    }
+
+def print_offline_results(results):
+    for r in results:
+        print(f"\nworkers={r['workers']} requests={r['requests']} errors={r['errors']} req/s={r['rps']:.2f}")
+        print(f"{'stage':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage, stats in r["stages"].items():
+            print(f"{stage:>12} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f} {stats['p99'] * 1000:>9.1f}")
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print the change of every metric against a saved baseline; return the regressions."""
+    regressions = []
+    previous = {r["workers"]: r for r in baseline["results"]}
+    print(f"\nChange versus baseline (regression threshold {tolerance:.0%}):")
+    for r in results:
+        old = previous.get(r["workers"])
+        if old is None:
+            continue
+        metrics = [("req/s", old["rps"], r["rps"], -1)]
+        for stage, stats in r["stages"].items():
+            for pct, value in stats.items():
+                if stage in old["stages"]:
+                    metrics.append((f"{stage} {pct}", old["stages"][stage][pct], value, 1))
+        for name, before, after, direction in metrics:
+            change = (after - before) / before if before else 0.0
+            regressed = direction * change > tolerance
+            if regressed:
+                regressions.append((r["workers"], name, change))
+            print(f"  workers={r['workers']:<3} {name:<18} {before:>9.3f} -> {after:>9.3f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def offline_environment(server_url, workdir):
+    """Settings pointing every upstream at local fakes, with indexes and caches under `workdir`."""
+    return {
+        "SERPER_URL": server_url,
+        "ALPHA_VANTAGE_URL": server_url,
+        "SERPER_API_KEY": "offline",
+        "ALPHA_VANTAGE_API_KEY": "offline",
+        "GEMINI_API_KEY": "offline",
+        "MISTRAL_API_KEY": "offline",
+        "VECTOR_BACKEND": "local",
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "index"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embedding_cache"),
+        "LLM_CACHE_PATH": "",
+        "ALPHA_VANTAGE_RATE_PER_MINUTE": "1000000",
+        "STREAMING": "true",
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+        "CREWAI_DISABLE_TELEMETRY": "true",
+        "OTEL_SDK_DISABLED": "true",
+    }
+
+def offline_benchmark(args):
+    """End-to-end latency and throughput against local fakes for every upstream."""
+    from stubs import FakeLLM, StubUpstreamServer, build_sample_index
+
+    server = StubUpstreamServer(latency=args.http_latency).start()
+    workdir = tempfile.mkdtemp(prefix="finance-bench-")
+    # Settings are read at import time, so the environment must be in place before utils loads
+    os.environ.update(offline_environment(server.url, workdir))
+    fake_llm = FakeLLM(latency=args.llm_latency).install()
+    try:
+        from utils import embeddings
+        from pipeline import FinancePipeline, STAGE_MESSAGES
+
+        build_sample_index(os.environ["LOCAL_INDEX_DIR"], embeddings)
+        queries = (DEFAULT_QUERIES * args.requests)[:args.requests]
+        results = []
+        for workers in args.workers:
+            pipeline = FinancePipeline(max_workers=workers, verbose=False, cache=None, fused=args.mode == "fused")
+            results.append(run_offline_level(pipeline, queries, workers, STAGE_MESSAGES))
+    finally:
+        fake_llm.uninstall()
+        server.stop()
+
+    print_offline_results(results)
+    report = {
+        "config": {"requests": args.requests, "mode": args.mode, "llm_latency": args.llm_latency, "http_latency": args.http_latency},
+        "results": results,
+    }
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            print(f"\nWarning: baseline was recorded with {baseline['config']}")
+        if compare_to_baseline(results, baseline, args.tolerance):
+            sys.exit(1)
+
+def quota_check(args):
+    """Check that batch stock queries wait out an exhausted Alpha Vantage quota instead of timing out.
+
+    Runs against the stub upstreams with a one-second STOCK_DEADLINE and a drained bucket
+    refilling one token per second, so each symbol's quote and history need longer than
+    the interactive deadline. Exits 1 if any source falls back to the timeout report.
+    """
+    from stubs import StubUpstreamServer
+
+    server = StubUpstreamServer(latency=0.01).start()
+    workdir = tempfile.mkdtemp(prefix="finance-quota-")
+    os.environ.update(offline_environment(server.url, workdir), STOCK_DEADLINE="1", ALPHA_VANTAGE_RATE_PER_MINUTE="60")
+    try:
+        from batch import apply_rate_limits
+        from quote_service import quote_service
+        from tasks import gather_stock_sources
+
+        apply_rate_limits(argparse.Namespace(serper_rate=None, gemini_rate=None, mistral_rate=None,
+                                             alpha_vantage_rate=None, quote_wait=args.quote_wait))
+        while quote_service.bucket.try_acquire():
+            pass
+        start = time.perf_counter()
+        timeouts = []
+        for symbol in args.symbols:
+            sources = gather_stock_sources(symbol)
+            timeouts += [f"{symbol} {name}" for name in ("stock_data", "history")
+                         if "timed out" in sources[name].get("error", "")]
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stop()
+
+    print(f"{len(args.symbols)} symbols over quota answered in {elapsed:.1f}s with --quote-wait {args.quote_wait:g}")
+    if timeouts:
+        print(f"FAIL: timed out instead of waiting for a token: {', '.join(timeouts)}")
+        sys.exit(1)
+    print("OK: every quote and history waited for a token")
+
+def run_process_level(url, queries, concurrency, stream_answer):
+    """Send every query to the worker pool from `concurrency` client threads."""
+    latencies = []
+    errors = 0
+
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            for _ in stream_answer(url, query):
+                pass
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, error in pool.map(timed, queries):
+            latencies.append(latency)
+            errors += error is not None
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(queries),
+        "errors": errors,
+        "rps": len(queries) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+    }
+
+def processes_benchmark(args):
+    """Throughput and memory per worker of the pre-forked serving mode, against local fakes.
+
+    Every query is distinct and the embedding cache is off, so each one runs the MiniLM
+    model; that CPU-bound step is what extra processes parallelise.
+    """
+    from stubs import FakeLLM, StubUpstreamServer, build_sample_index
+
+    server = StubUpstreamServer(latency=args.http_latency).start()
+    workdir = tempfile.mkdtemp(prefix="finance-bench-")
+    os.environ.update(offline_environment(server.url, workdir), EMBEDDING_CACHE_DIR="")
+    fake_llm = FakeLLM(latency=args.llm_latency).install()
+    results = []
+    try:
+        from utils import embeddings
+        from serve import WorkerPool, memory_usage, stream_answer
+
+        build_sample_index(os.environ["LOCAL_INDEX_DIR"], embeddings)
+        for processes in args.processes:
+            pool = WorkerPool(processes, port=0, threads=args.concurrency, use_cache=False, metrics_port=0).start()
+            try:
+                queries = [f"{query} ({processes}.{i})" for i, query in enumerate((DEFAULT_QUERIES * args.requests)[:args.requests])]
+                result = run_process_level(pool.url, queries, args.concurrency, stream_answer)
+                memory = list(pool.worker_memory().values())
+            finally:
+                pool.stop()
+            result.update(
+                processes=processes,
+                rss_mb=sum(m["rss"] for m in memory) / len(memory) / 2 ** 20,
+                pss_mb=sum(m["pss"] for m in memory) / len(memory) / 2 ** 20,
+                total_pss_mb=(sum(m["pss"] for m in memory) + memory_usage()["pss"]) / 2 ** 20,
+            )
+            results.append(result)
+    finally:
+        fake_llm.uninstall()
+        server.stop()
+
+    print(f"{'procs':>6} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} "
+          f"{'RSS/worker MB':>14} {'PSS/worker MB':>14} {'total PSS MB':>13} {'speedup':>8}")
+    base = results[0]["rps"] if results else 0.0
+    for r in results:
+        speedup = r["rps"] / base if base else 0.0
+        print(f"{r['processes']:>6} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.2f} {r['p50']:>7.2f} {r['p95']:>7.2f} "
+              f"{r['rss_mb']:>14.0f} {r['pss_mb']:>14.0f} {r['total_pss_mb']:>13.0f} {speedup:>7.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the finance chatbot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser("load", help="Throughput of the answer pipeline versus worker count.")
+    load.add_argument("--requests", type=int, default=16, help="Number of queries per run.")
+    load.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to compare.")
+    load.set_defaults(func=load_test)
+
+    startup = subparsers.add_parser("startup", help="Import time and time to first answer.")
+    startup.add_argument("--runs", type=int, default=3, help="Fresh processes per mode.")
+    startup.add_argument("--query", default=DEFAULT_QUERIES[0], help="Query used for the first answer.")
+    startup.set_defaults(func=startup_benchmark)
+
+    offline = subparsers.add_parser("offline", help="End-to-end stage latencies against local fakes of every upstream.")
+    offline.add_argument("--requests", type=int, default=32, help="Number of queries per concurrency level.")
+    offline.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Concurrency levels to compare.")
+    offline.add_argument("--mode", choices=["refined", "fused"], default="refined", help="Answer mode to measure.")
+    offline.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per fake LLM call.")
+    offline.add_argument("--http-latency", type=float, default=0.05, help="Seconds per stub Serper/Alpha Vantage call.")
+    offline.add_argument("--save-baseline", metavar="PATH", help="Write the results as a JSON baseline.")
+    offline.add_argument("--baseline", metavar="PATH", help="Compare against a saved baseline; exits 1 on regressions.")
+    offline.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression.")
+    offline.set_defaults(func=offline_benchmark)
+
+    processes = subparsers.add_parser("processes", help="Throughput and memory per worker of the pre-forked serving mode.")
+    processes.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="Worker process counts to compare.")
+    processes.add_argument("--requests", type=int, default=64, help="Number of queries per process count.")
+    processes.add_argument("--concurrency", type=int, default=8, help="Concurrent client connections.")
+    processes.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per fake LLM call.")
+    processes.add_argument("--http-latency", type=float, default=0.02, help="Seconds per stub Serper/Alpha Vantage call.")
+    processes.set_defaults(func=processes_benchmark)
+
+    quota = subparsers.add_parser("quota", help="Check that batch stock queries wait out an exhausted quote quota.")
+    quota.add_argument("--symbols", nargs="+", default=["AAPL", "MSFT", "NVDA"], help="Symbols fetched over quota.")
+    quota.add_argument("--quote-wait", type=float, default=30.0, help="Batch --quote-wait to check.")
+    quota.set_defaults(func=quota_check)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
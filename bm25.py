@@ -0,0 +1,130 @@
+# bm25.py
+
+import json
+import math
+import os
+import re
+import numpy as np
+
+BM25_FILE = "bm25.npz"
+BM25_CHUNKS_FILE = "bm25_chunks.json"
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.'][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its me my of on or the this to "
+    "what whats when where which who why with you your explain define tell about".split()
+)
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords; keeps terms like "ebitda", "p" and "10.5" intact."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over the ingested chunks, stored as compressed postings arrays.
+
+    The on-disk form is a term vocabulary with per-term IDF, postings in CSR layout
+    (document ids and term frequencies grouped by term) and document lengths, plus a JSON
+    sidecar with each chunk's id, text and source. A query touches only the postings of
+    its own terms, so exact terms such as "EBITDA" are found without running a model.
+    """
+
+    def __init__(self, vocab, idf, indptr, doc_ids, tfs, doc_len, chunks, k1=1.5, b=0.75):
+        self.vocab = {term: i for i, term in enumerate(vocab)}
+        self.idf = idf
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        # IDF of a term that occurs in no chunk; such query terms still count towards the maximum score
+        self.max_idf = math.log(1 + (len(chunks) + 0.5) / 0.5)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Build the index in memory from dicts with id, text and source."""
+        postings = {}
+        doc_len = np.zeros(len(chunks), dtype=np.float32)
+        for doc, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["text"])
+            doc_len[doc] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc, count))
+        vocab = sorted(postings)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for i, term in enumerate(vocab):
+            indptr[i + 1] = indptr[i] + len(postings[term])
+            for doc, count in postings[term]:
+                doc_ids.append(doc)
+                tfs.append(count)
+        df = np.diff(indptr).astype(np.float32)
+        idf = np.log(1 + (len(chunks) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        return cls(vocab, idf, indptr, np.asarray(doc_ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32), doc_len, chunks)
+
+    def write(self, path):
+        """Atomically write the index to `path`."""
+        os.makedirs(path, exist_ok=True)
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        tmp_arrays = os.path.join(path, BM25_FILE + ".tmp")
+        tmp_chunks = os.path.join(path, BM25_CHUNKS_FILE + ".tmp")
+        with open(tmp_arrays, "wb") as f:
+            np.savez_compressed(f, vocab=np.asarray(vocab, dtype=str), idf=self.idf, indptr=self.indptr,
+                                doc_ids=self.doc_ids, tfs=self.tfs, doc_len=self.doc_len)
+        with open(tmp_chunks, "w", encoding="utf-8") as f:
+            json.dump(self.chunks, f)
+        os.replace(tmp_arrays, os.path.join(path, BM25_FILE))
+        os.replace(tmp_chunks, os.path.join(path, BM25_CHUNKS_FILE))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(os.path.join(path, BM25_FILE)) as data:
+            arrays = {name: data[name] for name in data.files}
+        with open(os.path.join(path, BM25_CHUNKS_FILE), encoding="utf-8") as f:
+            chunks = json.load(f)
+        return cls(arrays["vocab"].tolist(), arrays["idf"], arrays["indptr"], arrays["doc_ids"], arrays["tfs"], arrays["doc_len"], chunks)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, BM25_FILE)) and os.path.exists(os.path.join(path, BM25_CHUNKS_FILE))
+
+    def search(self, query, top_k=3):
+        """Return the top_k chunks with their raw BM25 "score" and a "keyword_score" in [0, 1].
+
+        keyword_score is the score as a fraction of what an average-length chunk containing
+        every query term once would get (capped at 1), so it is comparable across queries and
+        usable as a threshold.
+        """
+        terms = set(tokenize(query))
+        if not terms or not len(self.chunks):
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        best = 0.0
+        for term in terms:
+            t = self.vocab.get(term)
+            if t is None:
+                best += self.max_idf
+                continue
+            best += float(self.idf[t])
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs, tf = self.doc_ids[start:end], self.tfs[start:end]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avg_len)
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1) / (tf + norm)
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k == 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.chunks[i].get("id"), "text": self.chunks[i]["text"], "source": self.chunks[i]["source"],
+             "score": float(scores[i]), "keyword_score": min(1.0, float(scores[i]) / best)}
+            for i in top
+        ]
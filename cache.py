@@ -0,0 +1,176 @@
+# cache.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from intent import normalize_rows
+
+# Settings
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+# SQLite file shared by worker processes; empty keeps the cache in process memory only
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "")
+
+# Seconds a cached report stays valid, per question type
+CATEGORY_TTLS = {
+    "finance_knowledge": 3 * 24 * 3600,
+    "out_of_scope": 24 * 3600,
+    "market_news": 10 * 60,
+    "stock_analysis": 5 * 60,
+}
+
+class SemanticCache:
+    """Size-bounded cache of final reports keyed by query embedding.
+
+    A lookup returns the stored report of the most similar unexpired query when its cosine
+    similarity clears `threshold` and its `tag` matches (e.g. the tickers mentioned, so that
+    "Analyze AAPL" never answers "Analyze MSFT"). When full, expired entries are dropped
+    first, then the least recently used one.
+    """
+
+    def __init__(self, embeddings, ttls=None, max_entries=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.embeddings = embeddings
+        self.ttls = dict(CATEGORY_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._vectors = None
+        self._entries = [None] * max_entries
+        self._expires = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _embed(self, query, vector):
+        if vector is None:
+            vector = self.embeddings.embed_query(query)
+        return normalize_rows(vector).ravel()
+
+    def lookup(self, query, vector=None, tag=None):
+        """Return the cached report for a near-duplicate query, or None."""
+        vector = self._embed(query, vector)
+        now = time.time()
+        with self._lock:
+            if self._vectors is not None:
+                similarities = self._vectors @ vector
+                similarities[self._expires <= now] = -1.0
+                candidates = np.flatnonzero(similarities >= self.threshold)
+                for slot in candidates[np.argsort(-similarities[candidates])]:
+                    entry = self._entries[slot]
+                    if entry["tag"] == tag:
+                        self._last_used[slot] = now
+                        self.hits += 1
+                        return entry["report"]
+            self.misses += 1
+            return None
+
+    def store(self, query, category, report, vector=None, tag=None):
+        """Cache a report under the query's embedding with the TTL of its category."""
+        ttl = self.ttls.get(category)
+        if not ttl:
+            return
+        vector = self._embed(query, vector)
+        now = time.time()
+        self._insert(vector, {"query": query, "category": category, "report": report, "tag": tag}, now + ttl, now)
+
+    def _insert(self, vector, entry, expires, now):
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            slot = self._free_slot(now)
+            self._vectors[slot] = vector
+            self._entries[slot] = entry
+            self._expires[slot] = expires
+            self._last_used[slot] = now
+
+    def _free_slot(self, now):
+        """Pick an empty or expired slot, evicting the least recently used entry if none is left."""
+        free = np.flatnonzero(self._expires <= now)
+        if free.size:
+            return int(free[0])
+        self.evictions += 1
+        return int(np.argmin(self._last_used))
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._entries = [None] * self.max_entries
+            self._expires[:] = 0
+            self._last_used[:] = 0
+
+    def stats(self):
+        """Return hit/miss counters and current occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": int((self._expires > time.time()).sum()),
+                "max_entries": self.max_entries,
+            }
+
+class SharedSemanticCache(SemanticCache):
+    """SemanticCache whose entries are shared by every process using the same SQLite file.
+
+    Each process keeps the in-memory matrix of SemanticCache and, before every lookup,
+    pulls the rows other processes appended since its last look. Stores go to the file
+    first and reach memory the same way, so a report cached by one worker answers
+    near-duplicates on all of them. The file keeps at most `max_entries` unexpired rows.
+    """
+
+    def __init__(self, embeddings, path, **kwargs):
+        super().__init__(embeddings, **kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._last_id = 0
+
+    def _connection(self):
+        if not hasattr(self._local, "db"):
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT, "
+                       "category TEXT, report TEXT, tag TEXT, vector BLOB, expires REAL)")
+            self._local.db = db
+        return self._local.db
+
+    def _sync(self):
+        """Copy rows appended by any process since the last sync into memory."""
+        now = time.time()
+        with self._sync_lock:
+            rows = self._connection().execute(
+                "SELECT id, query, category, report, tag, vector, expires FROM entries WHERE id > ? AND expires > ? ORDER BY id",
+                (self._last_id, now)
+            ).fetchall()
+            for row_id, query, category, report, tag, vector, expires in rows:
+                tag = tuple(json.loads(tag)) if tag is not None else None
+                entry = {"query": query, "category": category, "report": report, "tag": tag}
+                self._insert(np.frombuffer(vector, dtype=np.float32), entry, expires, now)
+                self._last_id = row_id
+
+    def lookup(self, query, vector=None, tag=None):
+        self._sync()
+        return super().lookup(query, vector=vector, tag=tag)
+
+    def store(self, query, category, report, vector=None, tag=None):
+        ttl = self.ttls.get(category)
+        if not ttl:
+            return
+        vector = self._embed(query, vector).astype(np.float32)
+        now = time.time()
+        db = self._connection()
+        db.execute("INSERT INTO entries (query, category, report, tag, vector, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                   (query, category, report, json.dumps(list(tag)) if tag is not None else None, vector.tobytes(), now + ttl))
+        db.execute("DELETE FROM entries WHERE expires <= ? OR id <= (SELECT MAX(id) FROM entries) - ?", (now, self.max_entries))
+        self._sync()
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
+        super().clear()
@@ -0,0 +1,129 @@
+# context_packer.py
+
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Settings
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "700"))
+WEB_TOKEN_BUDGET = int(os.getenv("WEB_TOKEN_BUDGET", "300"))
+# Chunks sharing this fraction of the shorter one's word trigrams count as duplicates
+DUPLICATE_OVERLAP = float(os.getenv("DUPLICATE_OVERLAP", "0.6"))
+# Don't bother truncating an item into less room than this
+MIN_TRUNCATED_TOKENS = 40
+# Neighbouring chunks of one source repeat up to ingest.CHUNK_OVERLAP characters of each
+# other; shared edges between these lengths are cut from the later packed chunk
+MIN_EDGE_OVERLAP = 10
+MAX_EDGE_OVERLAP = 200
+
+_WORD = re.compile(r"\w+")
+
+def estimate_tokens(text):
+    """Approximate Gemini token count; roughly four characters per token for English prose."""
+    return (len(text) + 3) // 4
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def _shared_edge(first, second):
+    """Length of the longest end of `first` that `second` starts with, within the overlap bounds."""
+    for length in range(min(len(first), len(second), MAX_EDGE_OVERLAP), MIN_EDGE_OVERLAP - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+def _trim_overlap(text, others):
+    """Cut the text a chunk shares with the start or end of already packed chunks from its source."""
+    for other in others:
+        head = _shared_edge(other, text)
+        if head:
+            text = text[head:].lstrip()
+        tail = _shared_edge(text, other)
+        if tail:
+            text = text[:-tail].rstrip()
+    return text
+
+def _truncate(text, tokens):
+    """Cut text to about `tokens` tokens at a word boundary."""
+    cut = text[:tokens * 4 - 3].rsplit(" ", 1)[0]
+    return cut.rstrip() + "..."
+
+def pack_context(items, budget, text_key="text", render=None):
+    """Deduplicate, rank and pack retrieved items into a token budget.
+
+    Items are ranked by their "score" (highest first) when they have one, otherwise kept in
+    retrieval order. An item whose trigrams mostly appear in an already packed one (the same
+    snippet from two sites, near-identical chunks) is dropped. Items with a "source" have
+    the text they share with the start or end of an already packed item from that source
+    (neighbouring chunks' ingestion overlap) cut. The last item that does not fit is
+    truncated if enough budget remains. `render(item)` gives the prompt text of an item.
+
+    Returns a dict with the packed "items", their rendered "text", the "tokens" spent,
+    counts of "duplicates" and "dropped" (over budget) items, and the "trimmed" tokens.
+    """
+    render = render or (lambda item: item[text_key])
+    ranked = sorted(items, key=lambda item: -(item.get("score") or 0.0)) if any("score" in item for item in items) else list(items)
+    packed, blocks, seen = [], [], []
+    tokens = duplicates = dropped = trimmed = 0
+    for item in ranked:
+        shingles = _shingles(item[text_key])
+        if any(len(shingles & other) >= DUPLICATE_OVERLAP * min(len(shingles), len(other)) for other in seen):
+            duplicates += 1
+            continue
+        if item.get("source") is not None:
+            text = _trim_overlap(item[text_key], [other[text_key] for other in packed if other.get("source") == item["source"]])
+            if not text:
+                duplicates += 1
+                continue
+            if text != item[text_key]:
+                trimmed += estimate_tokens(item[text_key]) - estimate_tokens(text)
+                item = dict(item, **{text_key: text})
+        block = render(item)
+        cost = estimate_tokens(block)
+        if tokens + cost > budget:
+            room = budget - tokens - (cost - estimate_tokens(item[text_key]))
+            if room < MIN_TRUNCATED_TOKENS:
+                dropped += 1
+                continue
+            item = dict(item, **{text_key: _truncate(item[text_key], room)})
+            block = render(item)
+            cost = estimate_tokens(block)
+        seen.append(shingles)
+        packed.append(item)
+        blocks.append(block)
+        tokens += cost
+    return {"items": packed, "text": "\n\n".join(blocks), "tokens": tokens, "duplicates": duplicates, "dropped": dropped,
+            "trimmed": trimmed}
+
+# Prompt tokens per task and source, accumulated over the process lifetime
+_usage_stats = {}
+_usage_lock = threading.Lock()
+
+def record_prompt_usage(task, prompt, sources):
+    """Record the tokens a prompt spends per source; the rest is counted as "instructions".
+
+    `sources` maps a source name to the tokens its packed context used.
+    """
+    usage = dict(sources)
+    usage["instructions"] = max(0, estimate_tokens(prompt) - sum(sources.values()))
+    with _usage_lock:
+        totals = _usage_stats.setdefault(task, {"prompts": 0, "tokens": {}})
+        totals["prompts"] += 1
+        for source, tokens in usage.items():
+            totals["tokens"][source] = totals["tokens"].get(source, 0) + tokens
+    logger.info("prompt=%s tokens=%d %s", task, sum(usage.values()), " ".join(f"{source}={tokens}" for source, tokens in usage.items()))
+    return usage
+
+def get_context_stats():
+    """Return prompt counts, total tokens per source and the average prompt size per task."""
+    with _usage_lock:
+        stats = {task: {"prompts": totals["prompts"], "tokens": dict(totals["tokens"])} for task, totals in _usage_stats.items()}
+    for totals in stats.values():
+        totals["avg_prompt_tokens"] = sum(totals["tokens"].values()) / totals["prompts"]
+    return stats
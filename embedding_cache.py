@@ -0,0 +1,244 @@
+# embedding_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Settings
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "/tmp/embedding_cache")
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "200000"))
+# Last-use times are written in batches of this many keys, or after this many seconds
+TOUCH_BATCH = 256
+TOUCH_INTERVAL = 30.0
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by model name plus text hash.
+
+    Vectors are packed float16 rows in `vectors.<generation>.f16`; a SQLite index in WAL
+    mode maps each key to its row and last-use time. SQLite serialises writers, so several
+    processes can share one directory, while lookups only read a snapshot and never wait
+    for the write lock. Compaction writes the next generation's file and deletes the old
+    one once it has committed, so a reader always pairs row numbers with the file they
+    belong to. Last-use times are buffered and written in batches. The cache is wiped when
+    opened for a different model, and once it exceeds `max_rows` it is compacted down to
+    the most recently used 80%.
+    """
+
+    def __init__(self, path, model_name, dimension, max_rows=EMBEDDING_CACHE_MAX_ROWS):
+        os.makedirs(path, exist_ok=True)
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_rows = max_rows
+        self.row_bytes = dimension * 2
+        self.path = path
+        self.db_path = os.path.join(path, "index.sqlite")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._touched_since = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER, last_used REAL)")
+            stored = dict(db.execute("SELECT key, value FROM meta").fetchall())
+            if (stored.get("model") != model_name or stored.get("dimension") != str(dimension)
+                    or "generation" not in stored):
+                self._reset(db)
+
+    def _connection(self):
+        if not hasattr(self._local, "db"):
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return self._local.db
+
+    def vectors_path(self, generation):
+        return os.path.join(self.path, f"vectors.{generation}.f16")
+
+    @staticmethod
+    def _meta(db, key):
+        return int(db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0])
+
+    def _next_generation(self, db):
+        """Point meta at a new, empty vector file; the old one is deleted after the commit."""
+        row = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        old = int(row[0]) if row else None
+        generation = (old or 0) + 1
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(generation),))
+        open(self.vectors_path(generation), "wb").close()
+        self._local.retired = [self.vectors_path(old)] if old is not None else [os.path.join(self.path, "vectors.f16")]
+        return generation
+
+    @contextmanager
+    def _transaction(self):
+        """Exclusive-write transaction; vector files retired inside it are deleted after the commit."""
+        db = self._connection()
+        self._local.retired = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        for path in self._local.retired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _snapshot(self):
+        """Read transaction: a consistent view of the index that does not block writers."""
+        db = self._connection()
+        db.execute("BEGIN")
+        try:
+            yield db
+        finally:
+            db.execute("COMMIT")
+
+    def _reset(self, db):
+        """Drop every entry, e.g. because the embedding model changed."""
+        db.execute("DELETE FROM rows")
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('model', ?), ('dimension', ?), ('next_row', '0')",
+                   (self.model_name, str(self.dimension)))
+        self._next_generation(db)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts):
+        """Return a list with the cached vector for each text, or None where it is missing."""
+        keys = [self.key(text) for text in texts]
+        results = [None] * len(texts)
+        with self._snapshot() as db:
+            found = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(db.execute(f"SELECT key, row FROM rows WHERE key IN ({placeholders})", batch).fetchall())
+            if found:
+                try:
+                    with open(self.vectors_path(self._meta(db, "generation")), "rb") as f:
+                        for i, key in enumerate(keys):
+                            if key in found:
+                                data = os.pread(f.fileno(), self.row_bytes, found[key] * self.row_bytes)
+                                if len(data) == self.row_bytes:
+                                    results[i] = np.frombuffer(data, dtype=np.float16).astype(np.float32)
+                except FileNotFoundError:
+                    # Compacted since the snapshot was taken; the caller recomputes
+                    found = {}
+        hits = sum(result is not None for result in results)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+        if found:
+            self._touch(found)
+        return results
+
+    def _touch(self, keys):
+        """Buffer last-use times, writing them once enough have piled up or enough time has passed."""
+        now = time.time()
+        with self._lock:
+            self._touched.update((key, now) for key in keys)
+            if len(self._touched) < TOUCH_BATCH and time.monotonic() - self._touched_since < TOUCH_INTERVAL:
+                return
+            touched, self._touched = self._touched, {}
+            self._touched_since = time.monotonic()
+        with self._transaction() as db:
+            self._write_touches(db, touched)
+
+    @staticmethod
+    def _write_touches(db, touched):
+        db.executemany("UPDATE rows SET last_used = ? WHERE key = ?", [(used, key) for key, used in touched.items()])
+
+    def flush(self):
+        """Write buffered last-use times now."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_since = time.monotonic()
+        if touched:
+            with self._transaction() as db:
+                self._write_touches(db, touched)
+
+    def put_many(self, texts, vectors):
+        """Append vectors for texts not yet cached, compacting when over the size limit."""
+        vectors = np.asarray(vectors, dtype=np.float16).reshape(len(texts), self.dimension)
+        now = time.time()
+        with self._transaction() as db:
+            next_row = self._meta(db, "next_row")
+            new, seen = [], set()
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key not in seen and db.execute("SELECT 1 FROM rows WHERE key = ?", (key,)).fetchone() is None:
+                    seen.add(key)
+                    new.append((key, next_row + len(new), vector))
+            if not new:
+                return
+            fd = os.open(self.vectors_path(self._meta(db, "generation")), os.O_RDWR | os.O_CREAT)
+            try:
+                os.pwrite(fd, b"".join(vector.tobytes() for _, _, vector in new), next_row * self.row_bytes)
+            finally:
+                os.close(fd)
+            db.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", [(key, row, now) for key, row, _ in new])
+            db.execute("UPDATE meta SET value = ? WHERE key = 'next_row'", (str(next_row + len(new)),))
+            if next_row + len(new) > self.max_rows:
+                self._compact(db)
+
+    def _compact(self, db):
+        """Keep the most recently used 80% of rows, rewriting them densely into the next generation's file."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        self._write_touches(db, touched)
+        keep = db.execute("SELECT key, row, last_used FROM rows ORDER BY last_used DESC LIMIT ?", (int(self.max_rows * 0.8),)).fetchall()
+        old_path = self.vectors_path(self._meta(db, "generation"))
+        with open(old_path, "rb") as src, open(self.vectors_path(self._next_generation(db)), "wb") as dst:
+            for _, row, _ in keep:
+                dst.write(os.pread(src.fileno(), self.row_bytes, row * self.row_bytes))
+        db.execute("DELETE FROM rows")
+        db.executemany("INSERT INTO rows VALUES (?, ?, ?)", [(key, new_row, last_used) for new_row, (key, _, last_used) in enumerate(keep)])
+        db.execute("UPDATE meta SET value = ? WHERE key = 'next_row'", (str(len(keep)),))
+
+    def clear(self):
+        with self._transaction() as db:
+            self._reset(db)
+
+    def stats(self):
+        rows = self._connection().execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / lookups if lookups else 0.0,
+                "rows": rows, "max_rows": self.max_rows}
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model for texts missing from the cache."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        results = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                results[i] = np.asarray(vector, dtype=np.float32)
+        return [vector.tolist() for vector in results]
+
+    def embed_query(self, text):
+        cached = self.cache.get_many([text])[0]
+        if cached is not None:
+            return cached.tolist()
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many([text], [vector])
+        return vector
@@ -0,0 +1,151 @@
+# evaluate_intent.py
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+# Held-out queries (none of them are in intent.SEED_EXAMPLES)
+DEFAULT_QUERIES = [
+    "What is a stock split?",
+    "Explain the time value of money",
+    "What does liquidity mean for a company?",
+    "How do mutual funds make money?",
+    "What is the meaning of gross margin?",
+    "What is a bear market rally?",
+    "Latest updates on the Nasdaq",
+    "Any news on interest rates today?",
+    "What is happening with Bitcoin this week?",
+    "Recent news on European markets",
+    "Top financial headlines this morning",
+    "Analyze IBM stock",
+    "How did AMD shares perform this quarter?",
+    "Is Apple stock a buy?",
+    "Give me a technical view on ORCL",
+    "Should I sell my Netflix shares?",
+    "How do I make pancakes?",
+    "Who wrote Hamlet?",
+    "Best hiking trails near Denver",
+    "How many players are on a soccer team?",
+]
+
+# Regressions for the rules tier, whose answer is final: expected (category, extra) or None
+# to leave the query to the embedding and LLM tiers
+RULE_CASES = [
+    ("What is an OTC stock?", None),
+    ("What does YTD performance mean?", None),
+    ("Is it OK to buy shares now?", None),
+    ("Which NYSE stocks pay dividends?", None),
+    ("Is NOW a good time to buy stocks?", None),
+    ("Analyze AAPL stock", None),
+    ("Explain FCF yield for stock valuation", ("finance_knowledge", "Explain FCF yield for stock valuation")),
+    ("What is the capital of France?", None),
+    ("What is a hedgehog?", None),
+    ("What's the weather today?", None),
+    ("Who won the game this week?", None),
+    ("Analyze $AAPL", ("stock_analysis", "AAPL")),
+    ("What is working capital?", ("finance_knowledge", "What is working capital?")),
+    ("Latest stock market news", ("market_news", "Latest stock market news")),
+]
+
+def check_rules():
+    """Run RULE_CASES through the rules tier; returns the number of failures."""
+    from utils import classify_by_rules
+
+    failures = 0
+    for query, expected in RULE_CASES:
+        actual = classify_by_rules(query)
+        if actual != expected:
+            failures += 1
+            print(f"  FAIL {query!r}: expected {expected}, got {actual}")
+    print(f"Rules tier: {len(RULE_CASES) - failures}/{len(RULE_CASES)} regression cases pass")
+    return failures
+
+def load_queries(path):
+    """Read queries from a JSONL file ({"query": ...} per line) or a plain text file."""
+    if not path:
+        return list(DEFAULT_QUERIES)
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+def load_labels(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {row["query"]: row["label"] for row in map(json.loads, f) if row.get("label")}
+
+def llm_label(query):
+    """Label a query with the LLM tiers of the production classifier."""
+    from utils import _create_classifier_agent, classify_combined, classify_legacy
+
+    agent = _create_classifier_agent()
+    try:
+        category, _ = classify_combined(query, agent)
+    except Exception:
+        category, _ = classify_legacy(query, agent)
+    return category
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the embedding intent classifier against LLM labels.")
+    parser.add_argument("--queries", help="JSONL or text file of queries (defaults to a built-in held-out set).")
+    parser.add_argument("--labels", default="intent_labels.jsonl", help="Cache of LLM labels; reused on later runs.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--check-rules", action="store_true",
+                        help="Only run the rules-tier regression cases; exits non-zero on a failure.")
+    args = parser.parse_args()
+
+    if args.check_rules:
+        raise SystemExit(1 if check_rules() else 0)
+
+    from utils import intent_classifier
+
+    queries = load_queries(args.queries)
+    labels = load_labels(args.labels)
+    missing = [q for q in queries if q not in labels]
+    if missing:
+        print(f"Labelling {len(missing)} queries with the LLM classifier...")
+        with open(args.labels, "a", encoding="utf-8") as f:
+            for query in missing:
+                try:
+                    labels[query] = llm_label(query)
+                except Exception as e:
+                    print(f"  skipped {query!r}: {e}")
+                    continue
+                f.write(json.dumps({"query": query, "label": labels[query]}) + "\n")
+
+    rows = []
+    start = time.perf_counter()
+    for query in queries:
+        if query in labels:
+            label, confidence = intent_classifier.classify(query)
+            rows.append((query, labels[query], label, confidence))
+    elapsed = time.perf_counter() - start
+    if not rows:
+        print("No labelled queries to evaluate.")
+        return
+
+    correct = sum(expected == predicted for _, expected, predicted, _ in rows)
+    print(f"\nQueries: {len(rows)}  accuracy: {correct / len(rows):.1%}  "
+          f"mean latency: {1000 * elapsed / len(rows):.1f} ms/query")
+
+    print(f"\n{'threshold':>9} {'coverage':>9} {'accuracy':>9}")
+    for threshold in args.thresholds:
+        confident = [(e, p) for _, e, p, c in rows if c >= threshold]
+        accuracy = sum(e == p for e, p in confident) / len(confident) if confident else 0.0
+        print(f"{threshold:>9.2f} {len(confident) / len(rows):>9.1%} {accuracy:>9.1%}")
+
+    confusion = Counter((expected, predicted) for _, expected, predicted, _ in rows if expected != predicted)
+    if confusion:
+        print("\nMisclassifications (LLM label -> embedding label):")
+        for (expected, predicted), count in confusion.most_common():
+            print(f"  {expected} -> {predicted}: {count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# evaluate_retrieval.py
+
+import argparse
+import json
+
+# Hand-labelled relevance set for the PDFs in Data/: True where the documents answer the
+# query, False where an answer needs the web or the query is not about finance at all
+DEFAULT_SET = [
+    ("What is a balance sheet?", True),
+    ("What does an income statement show?", True),
+    ("How is the current ratio calculated?", True),
+    ("What is working capital?", True),
+    ("Explain the debt to equity ratio", True),
+    ("What is return on equity?", True),
+    ("What is depreciation?", True),
+    ("What is a cash flow statement used for?", True),
+    ("What is gross profit margin?", True),
+    ("What is diversification?", True),
+    ("What is compound interest?", True),
+    ("What is a dividend?", True),
+    ("What is liquidity?", True),
+    ("Define inflation", True),
+    ("What is a bond?", True),
+    ("What is the difference between assets and liabilities?", True),
+    ("How do analysts use the price to earnings ratio?", True),
+    ("What is market capitalization?", True),
+    ("What did the Fed decide at its last meeting?", False),
+    ("Why did Nvidia shares move today?", False),
+    ("Latest news on the European Central Bank", False),
+    ("What is the current yield on the 10-year Treasury?", False),
+    ("Who is the CEO of Berkshire Hathaway?", False),
+    ("What were Apple's earnings last quarter?", False),
+    ("How do I bake sourdough bread?", False),
+    ("What is the capital of France?", False),
+    ("Best hiking trails near Denver", False),
+    ("How many players are on a soccer team?", False),
+]
+
+def load_set(path):
+    """Read {"query": ..., "relevant": true|false} lines, or return the built-in set."""
+    if not path:
+        return list(DEFAULT_SET)
+    with open(path, encoding="utf-8") as f:
+        return [(row["query"], bool(row["relevant"])) for row in map(json.loads, filter(str.strip, f))]
+
+def best_scores(contexts):
+    similarity = max((ctx.get("similarity") or 0.0 for ctx in contexts), default=0.0)
+    keyword_score = max((ctx.get("keyword_score") or 0.0 for ctx in contexts), default=0.0)
+    return similarity, keyword_score
+
+def evaluate(rows, similarity_threshold, keyword_threshold):
+    """Precision and recall of "sufficient" (either score clears its threshold) against the labels."""
+    predicted = [(s >= similarity_threshold or k >= keyword_threshold, relevant) for _, relevant, s, k in rows]
+    true_positives = sum(p and r for p, r in predicted)
+    flagged = sum(p for p, _ in predicted)
+    relevant = sum(r for _, r in predicted)
+    precision = true_positives / flagged if flagged else 1.0
+    recall = true_positives / relevant if relevant else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+def grid(start, stop, step):
+    return [round(start + i * step, 2) for i in range(int(round((stop - start) / step)) + 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the RAG relevance thresholds against a labelled query set.")
+    parser.add_argument("--set", help="JSONL file of {\"query\", \"relevant\"} rows (defaults to a built-in set).")
+    parser.add_argument("--skip-precision", type=float, default=0.95,
+                        help="Precision the web-skip thresholds must reach; of the pairs that do, the one "
+                             "with the best recall is suggested (ties go to the stricter pair).")
+    parser.add_argument("--verbose", action="store_true", help="Print the best scores of every query.")
+    args = parser.parse_args()
+
+    from utils import (search_qdrant, RETRIEVAL_TOP_K, RAG_SIMILARITY_THRESHOLD, RAG_KEYWORD_THRESHOLD,
+                       WEB_SKIP_SIMILARITY_THRESHOLD, WEB_SKIP_KEYWORD_THRESHOLD)
+
+    rows = []
+    for query, relevant in load_set(args.set):
+        similarity, keyword_score = best_scores(search_qdrant(query, RETRIEVAL_TOP_K))
+        rows.append((query, relevant, similarity, keyword_score))
+    if not any(relevant for _, relevant, _, _ in rows):
+        print("The set has no relevant queries; nothing to calibrate.")
+        return
+
+    if args.verbose:
+        print(f"{'relevant':>8} {'cosine':>7} {'keyword':>7}  query")
+        for query, relevant, similarity, keyword_score in rows:
+            print(f"{str(relevant):>8} {similarity:>7.3f} {keyword_score:>7.3f}  {query}")
+        print()
+
+    results = [((s, k), evaluate(rows, s, k)) for s in grid(0.3, 0.8, 0.05) for k in grid(0.3, 1.0, 0.05)]
+    # Best F1, breaking ties towards stricter thresholds
+    sufficient = max(results, key=lambda item: (item[1][2], item[0]))
+    confident = [item for item in results if item[1][0] >= args.skip_precision]
+    skip = max(confident, key=lambda item: (item[1][1], item[0])) if confident else None
+
+    print(f"Queries: {len(rows)} ({sum(r for _, r, _, _ in rows)} relevant)\n")
+    print(f"{'thresholds':<28} {'cosine':>6} {'keyword':>7} {'precision':>9} {'recall':>7} {'f1':>6}")
+    lines = [
+        ("current RAG_*", (RAG_SIMILARITY_THRESHOLD, RAG_KEYWORD_THRESHOLD)),
+        ("suggested RAG_* (best f1)", sufficient[0]),
+        ("current WEB_SKIP_*", (WEB_SKIP_SIMILARITY_THRESHOLD, WEB_SKIP_KEYWORD_THRESHOLD)),
+    ]
+    if skip is not None:
+        lines.append((f"suggested WEB_SKIP_* (p>={args.skip_precision:g})", skip[0]))
+    for name, (s, k) in lines:
+        precision, recall, f1 = evaluate(rows, s, k)
+        print(f"{name:<28} {s:>6.2f} {k:>7.2f} {precision:>9.1%} {recall:>7.1%} {f1:>6.2f}")
+    if skip is None:
+        print(f"\nNo thresholds in the grid reach {args.skip_precision:.0%} precision; keep WEB_SEARCH_MODE=always.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# http_client.py
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout, HTTPError
+
+# Settings
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_MAX_BACKOFF = float(os.getenv("HTTP_MAX_BACKOFF", "8"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """Bounded retries with full-jitter exponential backoff that honours Retry-After."""
+
+    def __init__(self, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_BACKOFF, max_backoff=HTTP_MAX_BACKOFF):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (0-based), or None to give up.
+
+        A Retry-After longer than `max_backoff` is not worth blocking a request for, so the
+        caller gets the rate-limit error straight away.
+        """
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_backoff else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+class HttpClient:
+    """Keep-alive, connection-pooled HTTP client with bounded retries.
+
+    Connection errors, timeouts, 429 and 5xx responses are retried according to the
+    RetryPolicy. The final failure is raised as the usual requests exception (HTTPError
+    carries the response), so callers keep their existing error handling.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retry=None):
+        self.retry = retry or RetryPolicy()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                delay = self.retry.delay(attempt, retry_after_seconds(response.headers.get("Retry-After")))
+                if delay is None:
+                    response.raise_for_status()
+            except (ConnectionError, Timeout):
+                delay = self.retry.delay(attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+class AsyncHttpClient:
+    """asyncio counterpart of HttpClient built on httpx, sharing its retry policy.
+
+    Failures are raised as the same requests exceptions as the sync client, so both paths
+    are handled identically by callers.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retry=None):
+        import httpx
+
+        self.retry = retry or RetryPolicy()
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        httpx = self._httpx
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, timeout=timeout, **kwargs)
+                if response.status_code < 400:
+                    return response
+                delay = None
+                if response.status_code in RETRY_STATUSES:
+                    delay = self.retry.delay(attempt, retry_after_seconds(response.headers.get("Retry-After")))
+                if delay is None:
+                    raise HTTPError(f"{response.status_code} Error for url: {url}", response=response)
+            except httpx.TimeoutException as e:
+                delay = self.retry.delay(attempt)
+                if delay is None:
+                    raise Timeout(str(e)) from e
+            except httpx.TransportError as e:
+                delay = self.retry.delay(attempt)
+                if delay is None:
+                    raise ConnectionError(str(e)) from e
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+class TokenBucket:
+    """Thread-safe token bucket matching an upstream quota of `rate` calls per `per` seconds."""
+
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = rate / per
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available right now."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout=None, floor=0.0):
+        """Wait up to `timeout` seconds (forever if None) for a token; returns whether one was taken.
+
+        Low-priority callers pass a `floor`: they only take a token while more than `floor`
+        would remain (or the bucket is full), leaving the rest to everyone else.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        needed = max(1.0, min(1.0 + floor, self.capacity))
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= 1
+                    return True
+                wait = (needed - self.tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+# Optional per-upstream call quotas shared by every thread, e.g. for overnight batch runs
+_rate_limits = {}
+_rate_limits_lock = threading.Lock()
+
+def set_rate_limit(upstream, per_minute):
+    """Allow at most `per_minute` calls to `upstream`; 0 or None removes the limit."""
+    with _rate_limits_lock:
+        if per_minute:
+            _rate_limits[upstream] = TokenBucket(per_minute, per=60.0, capacity=1)
+        else:
+            _rate_limits.pop(upstream, None)
+
+def rate_limit(upstream):
+    """Block until a call to `upstream` fits its quota; returns immediately when it has none."""
+    bucket = _rate_limits.get(upstream)
+    if bucket is not None:
+        bucket.acquire()
+
+# Shared clients; one pool of keep-alive connections per process
+_sync_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def get_http_client():
+    """Return the process-wide HttpClient."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = HttpClient()
+        return _sync_client
+
+def get_async_http_client():
+    """Return the AsyncHttpClient for the running event loop (httpx clients are loop-bound)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = AsyncHttpClient()
+        return _async_clients[loop]
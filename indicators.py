@@ -0,0 +1,171 @@
+# indicators.py
+
+import numpy as np
+
+# Trading days per year, for annualising volatility
+TRADING_DAYS = 252
+# Block length of the EMA recurrence; bounds the decay powers so they never underflow
+_EMA_BLOCK = 128
+
+def sma(values, window):
+    """Simple moving average; NaN until `window` values are available."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.insert(values, 0, 0.0))
+        out[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return out
+
+def rolling_std(values, window):
+    """Population standard deviation over a trailing window; NaN until `window` values are available."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.insert(values, 0, 0.0))
+        squares = np.cumsum(np.insert(values * values, 0, 0.0))
+        mean = (sums[window:] - sums[:-window]) / window
+        out[window - 1:] = np.sqrt(np.maximum(0.0, (squares[window:] - squares[:-window]) / window - mean * mean))
+    return out
+
+def ema(values, alpha):
+    """Exponential moving average seeded with the first value.
+
+    The recurrence e[t] = alpha * x[t] + (1 - alpha) * e[t - 1] is expanded into weighted
+    cumulative sums within blocks of _EMA_BLOCK values, carrying the last average from one
+    block to the next, so there is no per-element Python loop.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    previous = 0.0
+    for start in range(0, len(values), _EMA_BLOCK):
+        block = values[start:start + _EMA_BLOCK]
+        if start == 0:
+            block = block.copy()
+            # Seeding with the first value: e[0] = x[0]
+            block[0] = block[0] / alpha
+        powers = decay ** np.arange(1, len(block) + 1)
+        out[start:start + len(block)] = powers * previous + alpha * powers * np.cumsum(block / powers)
+        previous = out[start + len(block) - 1]
+    return out
+
+def span_alpha(span):
+    return 2.0 / (span + 1.0)
+
+def rsi(closes, period=14):
+    """Relative strength index with Wilder's smoothing; returns the series (NaN for the first `period`).
+
+    A stretch with neither gains nor losses (a flat series) scores a neutral 50.
+    """
+    out = np.full(len(closes), np.nan)
+    if len(closes) <= period:
+        return out
+    change = np.diff(closes)
+    gains = ema(np.clip(change, 0.0, None), 1.0 / period)
+    losses = ema(np.clip(-change, 0.0, None), 1.0 / period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[1:] = np.where(losses == 0, np.where(gains == 0, 50.0, 100.0), 100.0 - 100.0 / (1.0 + gains / losses))
+    out[:period] = np.nan
+    return out
+
+def macd(closes, fast=12, slow=26, signal=9):
+    """MACD line, signal line and histogram."""
+    line = ema(closes, span_alpha(fast)) - ema(closes, span_alpha(slow))
+    signal_line = ema(line, span_alpha(signal))
+    return line, signal_line, line - signal_line
+
+def bollinger(closes, window=20, width=2.0):
+    """Middle, upper and lower Bollinger bands."""
+    middle = sma(closes, window)
+    spread = width * rolling_std(closes, window)
+    return middle, middle + spread, middle - spread
+
+def realized_volatility(closes, window=20):
+    """Annualised standard deviation of daily log returns over the last `window` sessions."""
+    returns = np.diff(np.log(closes))[-window:]
+    return float(returns.std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(returns) > 1 else float("nan")
+
+def drawdown(closes):
+    """Current and maximum drawdown from the running peak, as negative fractions."""
+    peaks = np.maximum.accumulate(closes)
+    drawdowns = closes / peaks - 1.0
+    return float(drawdowns[-1]), float(drawdowns.min())
+
+def last_cross(fast, slow):
+    """("bullish" | "bearish", sessions ago) of the latest crossing of `fast` over `slow`, or None.
+
+    Sessions where the two are equal within floating-point tolerance keep the previous side,
+    so averages that touch or run together (a flat series) do not count as crossing.
+    """
+    valid = ~(np.isnan(fast) | np.isnan(slow))
+    side = np.where(valid & ~np.isclose(fast, slow, rtol=1e-9, atol=1e-12), np.sign(fast - slow), 0.0)
+    # Carry the last decided side forward over ties and NaNs
+    last_decided = np.maximum.accumulate(np.where(side != 0, np.arange(len(side)), 0))
+    side = side[last_decided]
+    flips = np.flatnonzero((side[1:] != side[:-1]) & (side[1:] != 0) & (side[:-1] != 0)) + 1
+    if not len(flips):
+        return None
+    i = flips[-1]
+    return ("bullish" if side[i] > 0 else "bearish", len(fast) - 1 - int(i))
+
+def _round(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+def summarize(closes):
+    """Compact indicator summary of a daily close series (oldest first)."""
+    closes = np.asarray(closes, dtype=np.float64)
+    sma20, sma50 = sma(closes, 20), sma(closes, 50)
+    ema12, ema26 = ema(closes, span_alpha(12)), ema(closes, span_alpha(26))
+    macd_line, signal_line, histogram = macd(closes)
+    middle, upper, lower = bollinger(closes)
+    current_drawdown, max_drawdown = drawdown(closes)
+    band_width = upper[-1] - lower[-1]
+    return {
+        "sessions": len(closes),
+        "close": _round(closes[-1]),
+        "return_20d": _round((closes[-1] / closes[-21] - 1) * 100) if len(closes) > 20 else None,
+        "sma20": _round(sma20[-1]),
+        "sma50": _round(sma50[-1]),
+        "sma_cross": last_cross(sma20, sma50),
+        "ema_cross": last_cross(ema12, ema26),
+        "rsi14": _round(rsi(closes)[-1], 1),
+        "macd": _round(macd_line[-1], 3),
+        "macd_signal": _round(signal_line[-1], 3),
+        "macd_histogram": _round(histogram[-1], 3),
+        "bollinger_upper": _round(upper[-1]),
+        "bollinger_lower": _round(lower[-1]),
+        # 0 at the lower band, 1 at the upper band
+        "bollinger_position": _round((closes[-1] - lower[-1]) / band_width) if band_width > 0 else None,
+        "volatility_20d": _round(realized_volatility(closes) * 100, 1),
+        "drawdown": _round(current_drawdown * 100, 1),
+        "max_drawdown": _round(max_drawdown * 100, 1),
+    }
+
+def _describe_cross(cross, name):
+    if cross is None:
+        return f"{name}: no crossover in range"
+    direction, ago = cross
+    return f"{name}: {direction} crossover {ago} sessions ago"
+
+def format_summary(summary):
+    """Render an indicator summary as short prompt lines; missing values are omitted."""
+    lines = [f"Indicators over the last {summary['sessions']} daily closes (last close {summary['close']}):"]
+    if summary["return_20d"] is not None:
+        lines.append(f"- 20-day return: {summary['return_20d']}%")
+    if summary["sma50"] is not None:
+        lines.append(f"- SMA20 {summary['sma20']} vs SMA50 {summary['sma50']}; {_describe_cross(summary['sma_cross'], 'SMA20/50')}")
+    if summary["sessions"] > 1:
+        lines.append(f"- {_describe_cross(summary['ema_cross'], 'EMA12/26')}")
+    if summary["rsi14"] is not None:
+        lines.append(f"- RSI(14): {summary['rsi14']}")
+    if summary["macd"] is not None:
+        lines.append(f"- MACD {summary['macd']}, signal {summary['macd_signal']}, histogram {summary['macd_histogram']}")
+    if summary["bollinger_upper"] is not None:
+        position = summary["bollinger_position"]
+        lines.append(f"- Bollinger(20, 2): {summary['bollinger_lower']} to {summary['bollinger_upper']}"
+                     + (f", position {position} (0 = lower band, 1 = upper band)" if position is not None else ""))
+    if summary["volatility_20d"] is not None:
+        lines.append(f"- Annualised 20-day volatility: {summary['volatility_20d']}%")
+    if summary["drawdown"] is not None:
+        lines.append(f"- Drawdown from peak: {summary['drawdown']}% (max {summary['max_drawdown']}%)")
+    return "\n".join(lines)
@@ -0,0 +1,219 @@
+# ingest.py
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+import numpy as np
+from utils import (
+    embeddings, get_embeddings, QDRANT_URL, QDRANT_API_KEY, COLLECTION_NAME, VECTOR_BACKEND, LOCAL_INDEX_DIR,
+    EMBEDDING_MODEL, EMBEDDING_DIMENSION
+)
+from vector_index import LocalVectorIndex, VECTORS_FILE, METADATA_FILE
+from bm25 import BM25Index
+
+# Settings
+DATA_DIR = "Data"
+MANIFEST_FILE = "ingest_manifest.json"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 20
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def chunk_id(source, page, index):
+    """Deterministic point ID for the index-th chunk of a page."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"finance-chatbot/{source}/{page}/{index}"))
+
+def empty_manifest():
+    return {"embedding_model": EMBEDDING_MODEL, "targets": [], "files": {}, "chunks": {}}
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def split_page(text):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return splitter.split_text(text)
+
+def plan_changes(data_dir, manifest):
+    """Compare the PDFs on disk with the manifest.
+
+    Unchanged files and pages are never re-split. Returns (files, chunks, upserts, deletes,
+    summary): the new manifest file and chunk tables, the chunks to (re-)embed, the point
+    IDs to remove, and the counts to report.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+
+    old_chunks = manifest["chunks"]
+    by_page = {}
+    for cid, info in old_chunks.items():
+        by_page.setdefault((info["source"], info["page"]), []).append(cid)
+
+    chunks, upserts = {}, []
+    summary = {"added": 0, "updated": 0, "skipped": 0, "deleted": 0}
+    files = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.pdf"))):
+        with open(path, "rb") as f:
+            file_hash = sha256(f.read())
+        previous = manifest["files"].get(path)
+        if previous and previous["sha256"] == file_hash:
+            files[path] = previous
+            for cid, info in old_chunks.items():
+                if info["source"] == path:
+                    chunks[cid] = info
+                    summary["skipped"] += 1
+            continue
+
+        pages = {}
+        for doc in PyPDFLoader(path).load():
+            page = doc.metadata.get("page", 0)
+            page_hash = sha256(doc.page_content)
+            pages[str(page)] = page_hash
+            if previous and previous["pages"].get(str(page)) == page_hash:
+                for cid in by_page.get((path, page), []):
+                    chunks[cid] = old_chunks[cid]
+                    summary["skipped"] += 1
+                continue
+            for index, text in enumerate(split_page(doc.page_content)):
+                cid = chunk_id(path, page, index)
+                info = {"source": path, "page": page, "sha256": sha256(text)}
+                chunks[cid] = info
+                if cid not in old_chunks:
+                    summary["added"] += 1
+                elif old_chunks[cid]["sha256"] != info["sha256"]:
+                    summary["updated"] += 1
+                else:
+                    summary["skipped"] += 1
+                    continue
+                upserts.append((cid, info, text))
+        files[path] = {"sha256": file_hash, "pages": pages}
+
+    deletes = [cid for cid in old_chunks if cid not in chunks]
+    summary["deleted"] = len(deletes)
+    return files, chunks, upserts, deletes, summary
+
+def embed_batches(texts, batch_size):
+    if not texts:
+        return np.zeros((0, EMBEDDING_DIMENSION), dtype=np.float32)
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    return np.asarray(vectors, dtype=np.float32)
+
+def sync_qdrant(upserts, vectors, deletes, batch_size, rebuild):
+    """Upsert changed chunks and delete removed ones in the Qdrant collection."""
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import Distance, PointIdsList, PointStruct, VectorParams
+
+    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+    if rebuild and client.collection_exists(COLLECTION_NAME):
+        client.delete_collection(COLLECTION_NAME)
+    if not client.collection_exists(COLLECTION_NAME):
+        client.create_collection(COLLECTION_NAME, vectors_config=VectorParams(size=EMBEDDING_DIMENSION, distance=Distance.COSINE))
+
+    for start in range(0, len(deletes), batch_size):
+        client.delete(COLLECTION_NAME, points_selector=PointIdsList(points=deletes[start:start + batch_size]))
+    for start in range(0, len(upserts), batch_size):
+        points = [
+            # Payload layout matches what langchain_qdrant writes and reads back
+            PointStruct(id=cid, vector=vector.tolist(), payload={"page_content": text, "metadata": {"source": info["source"], "page": info["page"]}})
+            for (cid, info, text), vector in zip(upserts[start:start + batch_size], vectors[start:start + batch_size])
+        ]
+        client.upsert(COLLECTION_NAME, points=points)
+
+def sync_local(index_dir, chunks, upserts, vectors):
+    """Rewrite the local index, reusing stored vectors for every chunk that did not change."""
+    rows, texts = {}, {}
+    if os.path.exists(os.path.join(index_dir, VECTORS_FILE)) and os.path.exists(os.path.join(index_dir, METADATA_FILE)):
+        existing = LocalVectorIndex(index_dir, embeddings)
+        for row, chunk in enumerate(existing.chunks):
+            if chunk.get("id") in chunks:
+                rows[chunk["id"]] = np.asarray(existing.vectors[row])
+                texts[chunk["id"]] = chunk["text"]
+    for (cid, info, text), vector in zip(upserts, vectors):
+        rows[cid] = vector
+        texts[cid] = text
+
+    missing = [cid for cid in chunks if cid not in rows]
+    if missing:
+        raise RuntimeError(f"{len(missing)} chunks are missing from the local index; run again with --rebuild")
+    ids = list(chunks)
+    matrix = np.stack([rows[cid] for cid in ids]) if ids else np.zeros((0, EMBEDDING_DIMENSION), dtype=np.float32)
+    metadata = [{"id": cid, "text": texts[cid], "source": chunks[cid]["source"], "page": chunks[cid]["page"]} for cid in ids]
+    LocalVectorIndex.write(index_dir, matrix, metadata)
+
+def sync_bm25(index_dir, chunks, upserts):
+    """Rebuild the BM25 keyword index over every current chunk.
+
+    Texts of unchanged chunks come from the previous index, so only changed pages are read.
+    Building needs no model, so the whole index is rewritten on every run.
+    """
+    texts = {}
+    if BM25Index.exists(index_dir):
+        for chunk in BM25Index.load(index_dir).chunks:
+            if chunk["id"] in chunks:
+                texts[chunk["id"]] = chunk["text"]
+    for cid, info, text in upserts:
+        texts[cid] = text
+
+    missing = [cid for cid in chunks if cid not in texts]
+    if missing:
+        raise RuntimeError(f"{len(missing)} chunks are missing from the BM25 index; run again with --rebuild")
+    BM25Index.from_chunks([
+        {"id": cid, "text": texts[cid], "source": chunks[cid]["source"], "page": chunks[cid]["page"]}
+        for cid in chunks
+    ]).write(index_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally ingest the PDFs in Data/ into the vector stores.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--index-dir", default=LOCAL_INDEX_DIR, help="Local index and manifest location.")
+    parser.add_argument("--targets", nargs="+", choices=["qdrant", "local"], default=[VECTOR_BACKEND])
+    parser.add_argument("--batch-size", type=int, default=128, help="Chunks per embedding and upsert batch.")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the manifest and re-ingest everything.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest_path = os.path.join(args.index_dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    if args.rebuild or manifest["embedding_model"] != EMBEDDING_MODEL:
+        manifest = empty_manifest()
+        args.rebuild = True
+    elif manifest["chunks"] and sorted(manifest["targets"]) != sorted(args.targets):
+        parser.error(f"manifest was built for targets {manifest['targets']}; pass --rebuild to change them")
+
+    files, chunks, upserts, deletes, summary = plan_changes(args.data_dir, manifest)
+    vectors = embed_batches([text for _, _, text in upserts], args.batch_size)
+
+    if "qdrant" in args.targets:
+        sync_qdrant(upserts, vectors, deletes, args.batch_size, args.rebuild)
+    if "local" in args.targets:
+        sync_local(args.index_dir, chunks, upserts, vectors)
+    sync_bm25(args.index_dir, chunks, upserts)
+
+    save_manifest(manifest_path, {"embedding_model": EMBEDDING_MODEL, "targets": sorted(args.targets), "files": files, "chunks": chunks})
+    print(f"Ingested {len(files)} files into {', '.join(args.targets)} in {time.perf_counter() - start:.1f}s: "
+          f"{summary['added']} chunks added, {summary['updated']} updated, {summary['skipped']} skipped, "
+          f"{summary['deleted']} deleted ({len(chunks)} total).")
+    if upserts and hasattr(get_embeddings(), "cache"):
+        stats = get_embeddings().cache.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['rows']} rows stored).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# intent.py
+
+import threading
+import numpy as np
+
+# Labeled seed queries; every new example sharpens the nearest-neighbour vote
+SEED_EXAMPLES = {
+    "finance_knowledge": [
+        "What is revenue?",
+        "Explain P/E ratio and its importance",
+        "What is the difference between bull and bear markets?",
+        "What is the balance of payments?",
+        "How does compound interest work?",
+        "What does EBITDA mean?",
+        "Define working capital",
+        "What is a dividend yield?",
+        "How do bonds work?",
+        "What is diversification in investing?",
+        "Explain the difference between assets and liabilities",
+        "What is a cash flow statement?",
+        "How is return on equity calculated?",
+        "What is an index fund?",
+        "What is inflation and how does it affect savings?",
+        "What are current ratio and quick ratio?",
+    ],
+    "market_news": [
+        "Latest news about cryptocurrency market",
+        "What's the latest market news?",
+        "What happened in the stock market today?",
+        "Recent news on the tech sector",
+        "Any updates on the Federal Reserve interest rate decision?",
+        "Latest headlines about oil prices",
+        "What are the current trends in the housing market?",
+        "News about bank earnings this week",
+        "What is moving the markets this morning?",
+        "Latest updates on inflation data release",
+        "Recent developments in the bond market",
+        "What's going on with gold prices right now?",
+    ],
+    "stock_analysis": [
+        "Analyze AAPL stock performance",
+        "Analyze Tesla stock",
+        "How is MSFT doing?",
+        "Should I buy NVDA shares?",
+        "Give me an analysis of META stock",
+        "What is the outlook for AMZN stock?",
+        "Is GOOGL a good investment right now?",
+        "Technical analysis of JPM",
+        "How has TSLA performed recently?",
+        "Stock price trend for NFLX",
+        "Evaluate Coca-Cola stock performance",
+        "Compare AAPL and MSFT stock",
+    ],
+    "out_of_scope": [
+        "How do I bake a chocolate cake?",
+        "What's the weather like tomorrow?",
+        "Who won the football match yesterday?",
+        "Tell me a joke",
+        "How do I fix my bicycle chain?",
+        "What is the capital of France?",
+        "Recommend a good movie to watch",
+        "How do I learn to play guitar?",
+        "Write a poem about the ocean",
+        "What is the best way to lose weight?",
+        "How do I install Python on Windows?",
+        "Translate hello into Spanish",
+    ],
+}
+
+def normalize_rows(matrix):
+    """L2-normalise rows so dot products are cosine similarities."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+class IntentClassifier:
+    """Cosine kNN intent classifier over a matrix of embedded seed queries.
+
+    The seed matrix is embedded once, on first use. Classifying a query is then one
+    embedding plus a single matrix-vector product.
+    """
+
+    def __init__(self, embeddings, examples=None, k=5, min_similarity=0.3):
+        self.embeddings = embeddings
+        self.examples = examples or SEED_EXAMPLES
+        self.k = k
+        self.min_similarity = min_similarity
+        self.labels = list(self.examples)
+        self._matrix = None
+        self._label_ids = None
+        self._lock = threading.Lock()
+
+    def _ensure_matrix(self):
+        if self._matrix is None:
+            with self._lock:
+                if self._matrix is None:
+                    texts, label_ids = [], []
+                    for label_id, label in enumerate(self.labels):
+                        texts.extend(self.examples[label])
+                        label_ids.extend([label_id] * len(self.examples[label]))
+                    self._label_ids = np.asarray(label_ids)
+                    self._matrix = normalize_rows(self.embeddings.embed_documents(texts))
+        return self._matrix
+
+    def scores_for_vector(self, vector):
+        """Return a {label: score} dict for an embedded query.
+
+        Scores sum to 1, or are all zero when no seed is at least `min_similarity` close.
+        """
+        matrix = self._ensure_matrix()
+        similarities = matrix @ normalize_rows(vector).ravel()
+        k = min(self.k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        if similarities[top].max() < self.min_similarity:
+            return {label: 0.0 for label in self.labels}
+        # Similarity-weighted vote among the k nearest seeds
+        weights = np.clip(similarities[top], 0.0, None)
+        votes = np.bincount(self._label_ids[top], weights=weights, minlength=len(self.labels))
+        total = votes.sum()
+        if total <= 0:
+            return {label: 0.0 for label in self.labels}
+        return {label: float(votes[i] / total) for i, label in enumerate(self.labels)}
+
+    def classify_vector(self, vector):
+        """Return (label, confidence) for an embedded query."""
+        scores = self.scores_for_vector(vector)
+        label = max(scores, key=scores.get)
+        return label, scores[label]
+
+    def classify(self, query):
+        """Return (label, confidence) for a raw query string."""
+        return self.classify_vector(self.embeddings.embed_query(query))
@@ -0,0 +1,147 @@
+# llm_cache.py
+
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from tracing import record_cache
+
+# Settings
+# One SQLite file shared by every process on the host; set LLM_CACHE_PATH= to disable the cache
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/llm_cache.sqlite")
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "20000"))
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true"
+
+# Seconds a completion stays valid, per call site. Prompts that embed live data (news
+# snippets, quotes) change with the data, so these only bound how long a given prompt is reused.
+CALL_SITE_TTLS = {
+    "classifier": 30 * 24 * 3600,
+    "specialist": 24 * 3600,
+    "refiner": 24 * 3600,
+}
+DEFAULT_TTL = 3600
+for _call_site in CALL_SITE_TTLS:
+    _override = os.getenv(f"LLM_CACHE_TTL_{_call_site.upper()}")
+    if _override:
+        CALL_SITE_TTLS[_call_site] = int(_override)
+
+_bypassed = contextvars.ContextVar("llm_cache_bypassed", default=False)
+
+@contextmanager
+def bypass_llm_cache():
+    """Neither read nor write the LLM cache inside this block (and work submitted from it)."""
+    token = _bypassed.set(True)
+    try:
+        yield
+    finally:
+        _bypassed.reset(token)
+
+class LLMResponseCache:
+    """Persistent cache of LLM completions keyed by model, temperature and a hash of the prompt.
+
+    Entries live in one SQLite file in WAL mode, so any number of threads and processes can
+    share it. Each entry expires after its call site's TTL; once the file holds more than
+    `max_rows` entries, expired ones are deleted, then the least recently used down to 80%.
+    Set `enabled` to False, or use `bypass_llm_cache()`, when an answer must be fresh.
+    """
+
+    def __init__(self, path, ttls=None, max_rows=LLM_CACHE_MAX_ROWS, enabled=True):
+        self.path = path
+        self.ttls = dict(CALL_SITE_TTLS, **(ttls or {}))
+        self.max_rows = max_rows
+        self.enabled = enabled
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def _connection(self):
+        """Per-thread connection; the file and table are created on first use, not at import."""
+        if not hasattr(self._local, "db"):
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, call_site TEXT, model TEXT, "
+                       "response TEXT, expires REAL, last_used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._local.db = db
+        return self._local.db
+
+    @staticmethod
+    def key(model, temperature, prompt):
+        return hashlib.sha256(f"{model}\0{temperature}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def active(self):
+        return self.enabled and not _bypassed.get()
+
+    def _count(self, counts, call_site):
+        with self._stats_lock:
+            counts[call_site] = counts.get(call_site, 0) + 1
+
+    def get(self, call_site, model, temperature, prompt):
+        """Return the cached completion for this exact prompt, or None."""
+        if not self.active():
+            return None
+        key = self.key(model, temperature, prompt)
+        now = time.time()
+        db = self._connection()
+        row = db.execute("SELECT response, expires FROM responses WHERE key = ?", (key,)).fetchone()
+        hit = row is not None and row[1] > now
+        if hit:
+            db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self._count(self.hits if hit else self.misses, call_site)
+        record_cache("llm", hit)
+        return row[0] if hit else None
+
+    def put(self, call_site, model, temperature, prompt, response):
+        """Store a completion for the call site's TTL, evicting when over the size limit."""
+        if not self.active() or not response:
+            return
+        now = time.time()
+        expires = now + self.ttls.get(call_site, DEFAULT_TTL)
+        db = self._connection()
+        db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                   (self.key(model, temperature, prompt), call_site, model, response, expires, now))
+        if db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] > self.max_rows:
+            self._evict(db, now)
+
+    def _evict(self, db, now):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+            db.execute("DELETE FROM responses WHERE key NOT IN "
+                       "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)", (int(self.max_rows * 0.8),))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def clear(self):
+        self._connection().execute("DELETE FROM responses")
+
+    def stats(self):
+        rows = self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        with self._stats_lock:
+            hits, misses = dict(self.hits), dict(self.misses)
+        lookups = sum(hits.values()) + sum(misses.values())
+        return {"hits": hits, "misses": misses, "hit_rate": sum(hits.values()) / lookups if lookups else 0.0,
+                "rows": rows, "max_rows": self.max_rows}
+
+def task_messages(task):
+    """The chat messages for a CrewAI task: the agent's persona, then the task and its expected output."""
+    agent = task.agent
+    return [
+        {"role": "system", "content": f"You are {agent.role}. {agent.backstory}\nYour personal goal is: {agent.goal}"},
+        {"role": "user", "content": f"{task.description}\n\nThis is the expected output for your final answer: {task.expected_output}"},
+    ]
+
+def task_prompt(task):
+    """The full prompt of a task as one string, for cache keys."""
+    return json.dumps(task_messages(task), sort_keys=True)
+
+# Shared cache, or None when LLM_CACHE_PATH is empty
+llm_cache = LLMResponseCache(LLM_CACHE_PATH, enabled=not LLM_CACHE_BYPASS) if LLM_CACHE_PATH else None
@@ -0,0 +1,422 @@
+# pipeline.py
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from crewai import Crew, Process
+from agents import create_agents
+from tasks import (
+    get_finance_knowledge_task, get_market_news_task, get_stock_analysis_task, get_stock_comparison_task,
+    get_response_refiner_task, gather_comparison_sources, gather_finance_knowledge_sources, gather_stock_sources,
+    get_web_search_stats
+)
+from context_packer import get_context_stats
+from cache import SemanticCache, SharedSemanticCache, SEMANTIC_CACHE_PATH
+from quote_service import get_quote
+from http_client import rate_limit
+from tracing import Trace, span, start_trace, traced, record_cache, record_llm_call, submit_in_context
+from llm_cache import llm_cache, task_messages, task_prompt
+from report import parse_report, render_report, out_of_scope_report
+from utils import (
+    QueryContext, comparison_symbols, determine_question_type, embeddings, extract_tickers, get_classifier_stats, io_executor,
+    rag_is_sufficient, stream_completion
+)
+
+logger = logging.getLogger(__name__)
+
+# Settings
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+STREAMING = os.getenv("STREAMING", "true").lower() == "true"
+# "refined": specialist answer, then a refiner call; "fused": the specialist writes the report itself
+ANSWER_MODE = os.getenv("ANSWER_MODE", "refined").lower()
+# Most tickers a single stock query compares; each costs one Alpha Vantage call
+MAX_COMPARE_SYMBOLS = int(os.getenv("MAX_COMPARE_SYMBOLS", "5"))
+
+# Progress lines shown in the UI while the report is not ready yet
+STAGE_MESSAGES = {
+    "classifying": "Classifying your question...",
+    "retrieving": "Retrieving documents and market data...",
+    "analyzing": "Analyzing...",
+    "reporting": "Writing the report...",
+}
+
+# Final reports shared by every pipeline in the process, and by every worker process when SEMANTIC_CACHE_PATH is set
+answer_cache = SharedSemanticCache(embeddings, SEMANTIC_CACHE_PATH) if SEMANTIC_CACHE_PATH else SemanticCache(embeddings)
+
+# Outcome counts for speculative prefetches, per source
+_speculation_stats = {"started": {}, "useful": {}, "wasted": {}}
+_speculation_stats_lock = threading.Lock()
+
+def _count_speculation(outcome, name):
+    with _speculation_stats_lock:
+        _speculation_stats[outcome][name] = _speculation_stats[outcome].get(name, 0) + 1
+
+def get_speculation_stats():
+    """Return started/useful/wasted counts per speculative source and the overall useful rate."""
+    with _speculation_stats_lock:
+        stats = {outcome: dict(counts) for outcome, counts in _speculation_stats.items()}
+    started = sum(stats["started"].values())
+    stats["useful_rate"] = sum(stats["useful"].values()) / started if started else 0.0
+    return stats
+
+class Speculation:
+    """Retrieval started while the classifier is still running.
+
+    The Qdrant lookup always starts; a quote prefetch starts when the query contains a
+    ticker-like token. Prefetches are claimed by the task builders when the classified
+    category needs them and are counted as wasted otherwise.
+    """
+
+    def __init__(self, context):
+        self.futures = {"contexts": submit_in_context(io_executor, context.search, 3)}
+        tickers = extract_tickers(context.text)
+        self.symbol = tickers[0] if tickers else None
+        if self.symbol:
+            self.futures["stock_data"] = submit_in_context(io_executor, get_quote, self.symbol)
+        self.claimed = set()
+        for name in self.futures:
+            _count_speculation("started", name)
+
+    def claim(self, *names, symbol=None):
+        """Hand the named prefetches to a task builder; a quote is only usable for the same symbol."""
+        prefetched = {}
+        for name in names:
+            if name not in self.futures or (name == "stock_data" and symbol != self.symbol):
+                continue
+            self.claimed.add(name)
+            prefetched[name] = self.futures[name]
+        return prefetched
+
+    def finish(self):
+        """Record which prefetches were used and cancel any unclaimed work not yet started."""
+        for name, future in self.futures.items():
+            if name in self.claimed:
+                _count_speculation("useful", name)
+            else:
+                future.cancel()
+                _count_speculation("wasted", name)
+
+# How final reports were produced: LLM refiner, local formatter, or fixed template
+_answer_stats = {"refined": 0, "fused": 0, "fused_fallback": 0, "templated": 0}
+_answer_stats_lock = threading.Lock()
+
+def _count_answer(outcome):
+    with _answer_stats_lock:
+        _answer_stats[outcome] += 1
+
+def get_answer_stats():
+    """Return report counts per path and the number of refiner LLM calls avoided."""
+    with _answer_stats_lock:
+        stats = dict(_answer_stats)
+    stats["refiner_calls_avoided"] = stats["fused"] + stats["templated"]
+    return stats
+
+def print_stats():
+    """Print the process's classifier, cache, report, web search and prompt token statistics."""
+    stats = get_classifier_stats()
+    rates = ", ".join(f"{tier} {rate:.0%}" for tier, rate in stats["hit_rates"].items())
+    print(f"Classifier tiers: {rates} ({stats['llm_calls_avoided']} LLM calls avoided)")
+    cache_stats = answer_cache.stats()
+    print(f"Answer cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    if llm_cache is not None:
+        llm_stats = llm_cache.stats()
+        hits = ", ".join(f"{site} {count}" for site, count in llm_stats["hits"].items()) or "none"
+        print(f"LLM cache: {llm_stats['hit_rate']:.0%} hit rate (hits: {hits}), {llm_stats['rows']} entries")
+    answer_stats = get_answer_stats()
+    print(f"Reports: {answer_stats['fused']} fused, {answer_stats['fused_fallback']} fused fallbacks, "
+          f"{answer_stats['refined']} refined, {answer_stats['templated']} templated "
+          f"({answer_stats['refiner_calls_avoided']} refiner calls avoided)")
+    web_stats = get_web_search_stats()
+    print(f"Knowledge web searches: {web_stats['searched']} searched, {web_stats['skipped']} skipped, "
+          f"{web_stats['raced']} raced, {web_stats['dropped']} dropped as late "
+          f"({web_stats['serper_calls_avoided']} Serper calls avoided)")
+    for task, usage in get_context_stats().items():
+        sources = ", ".join(f"{source} {tokens}" for source, tokens in usage["tokens"].items())
+        print(f"Prompt tokens for {task}: {usage['avg_prompt_tokens']:.0f} avg over {usage['prompts']} prompts ({sources})")
+
+def _log_latency(query, start, first_token, cached=False):
+    end = time.perf_counter()
+    ttfb = (first_token or end) - start
+    logger.info("query=%r cached=%s time_to_first_token=%.2fs total=%.2fs", query[:80], cached, ttfb, end - start)
+
+class RequestContext:
+    """Isolated execution state for a single query: its own agents, tasks and crews."""
+
+    def __init__(self, query, verbose=True, fused=False):
+        self.context = QueryContext(query)
+        self.query = self.context.text
+        self.verbose = verbose
+        self.fused = fused
+        self._agents = None
+        self.question_type = None
+        self.processed_query = None
+        self.rag_note = "RAG_SUFFICIENT"
+        self.speculation = None
+
+    @property
+    def agents(self):
+        """This request's agents, built on first use so cache hits never create any."""
+        if self._agents is None:
+            self._agents = create_agents(verbose=self.verbose)
+        return self._agents
+
+    def kickoff(self, task, stage="specialist"):
+        """Run a single task on a crew owned by this request, traced as `stage`.
+
+        Returns the cached completion instead when the same prompt was answered before.
+        """
+        llm = task.agent.llm
+        cache_key = task_prompt(task)
+        cached = llm_cache.get(stage, llm.model, llm.temperature, cache_key) if llm_cache is not None else None
+        if cached is not None:
+            return cached
+        crew = Crew(
+            agents=list(self.agents.values()),
+            tasks=[task],
+            process=Process.sequential,
+            verbose=self.verbose
+        )
+        rate_limit("gemini")
+        with span(stage) as attrs:
+            result = crew.kickoff()
+            record_llm_call(stage, llm.model, getattr(result, "token_usage", None), attrs)
+        if llm_cache is not None:
+            llm_cache.put(stage, llm.model, llm.temperature, cache_key, str(result))
+        return result
+
+    def stream(self, task, stage="specialist"):
+        """Run a single task as one streamed completion, yielding text chunks as they arrive.
+
+        A cached completion is yielded in one piece. Falls back to a regular crew kickoff if
+        streaming fails before the first chunk.
+        """
+        llm = task.agent.llm
+        cache_key = task_prompt(task)
+        cached = llm_cache.get(stage, llm.model, llm.temperature, cache_key) if llm_cache is not None else None
+        if cached is not None:
+            yield cached
+            return
+        started = False
+        chunks = []
+        try:
+            with span(stage, streamed=True) as attrs:
+                for chunk in stream_completion(llm, task_messages(task), call_site=stage, attrs=attrs):
+                    started = True
+                    chunks.append(chunk)
+                    yield chunk
+        except Exception:
+            if started:
+                raise
+            logger.warning("Streaming failed, falling back to a blocking kickoff", exc_info=True)
+            yield str(self.kickoff(task, stage))
+            return
+        if llm_cache is not None:
+            llm_cache.put(stage, llm.model, llm.temperature, cache_key, "".join(chunks))
+
+    def build_initial_task(self):
+        """Pick the specialist task for the classified query."""
+        if self.question_type == "finance_knowledge":
+            # One concurrent fetch feeds both the RAG assessment and the task prompt
+            sources = gather_finance_knowledge_sources(self.query, prefetched=self._claim("contexts"), context=self.context)
+            self.rag_note = "RAG_SUFFICIENT" if rag_is_sufficient(sources["contexts"]) else "RAG_NOT_USED"
+            return get_finance_knowledge_task(self.query, agent=self.agents["finance_knowledge"], sources=sources, fused=self.fused)
+        elif self.question_type == "market_news":
+            self.rag_note = "NO_RAG_NEEDED"
+            return get_market_news_task(self.query, agent=self.agents["market_news"], fused=self.fused)
+        elif self.question_type == "stock_analysis":
+            self.rag_note = "NO_RAG_NEEDED"
+            symbols = comparison_symbols(self.query, self.processed_query)[:MAX_COMPARE_SYMBOLS]
+            if len(symbols) > 1:
+                sources = gather_comparison_sources(symbols)
+                if len(sources["symbols"]) > 1:
+                    return get_stock_comparison_task(sources["symbols"], agent=self.agents["stock_analysis"], sources=sources, fused=self.fused)
+            sources = gather_stock_sources(self.processed_query, prefetched=self._claim("stock_data", symbol=self.processed_query))
+            return get_stock_analysis_task(self.processed_query, agent=self.agents["stock_analysis"], sources=sources, fused=self.fused)
+        return get_finance_knowledge_task(self.query, agent=self.agents["finance_knowledge"], fused=self.fused)
+
+    def render_fused(self, draft):
+        """Render a fused-mode specialist answer locally, or None if it needs the refiner."""
+        fields = parse_report(draft)
+        if fields is None:
+            _count_answer("fused_fallback")
+            return None
+        _count_answer("fused")
+        return render_report(self.query, fields, self.rag_note)
+
+    def finish_speculation(self):
+        if self.speculation is not None:
+            self.speculation.finish()
+            self.speculation = None
+
+    def _claim(self, *names, symbol=None):
+        if self.speculation is None:
+            return None
+        return self.speculation.claim(*names, symbol=symbol)
+
+class FinancePipeline:
+    """Reusable, thread-safe query pipeline shared by the web UI and the terminal client.
+
+    Every call to `run` builds a fresh RequestContext, so any number of queries can be
+    processed in parallel without sharing a Crew or its task list.
+    """
+
+    def __init__(self, max_workers=PIPELINE_WORKERS, verbose=True, cache=answer_cache, speculative=SPECULATIVE_RETRIEVAL,
+                 fused=ANSWER_MODE == "fused"):
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self.cache = cache
+        self.speculative = speculative
+        self.fused = fused
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pipeline")
+        return self._executor
+
+    def _context(self, query):
+        return RequestContext(query, verbose=self.verbose, fused=self.fused)
+
+    def _cache_lookup(self, ctx):
+        vector = ctx.context.vector
+        with span("answer_cache"):
+            report = self.cache.lookup(ctx.query, vector=vector, tag=tuple(extract_tickers(ctx.query)))
+        record_cache("answer", report is not None)
+        return report
+
+    def _cache_store(self, ctx, report):
+        self.cache.store(ctx.query, ctx.question_type, report, vector=ctx.context.vector, tag=tuple(extract_tickers(ctx.query)))
+
+    def run(self, query):
+        """Return a cached report for a near-duplicate query, or compute and cache a new one."""
+        trace, error = start_trace(), None
+        try:
+            ctx = self._context(query)
+            if self.cache is None:
+                return self.answer(query, ctx=ctx)[1]
+            report = self._cache_lookup(ctx)
+            if report is None:
+                report = str(self.answer(query, ctx=ctx)[1])
+                self._cache_store(ctx, report)
+            return report
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            trace.finish(error=error)
+
+    def _classify(self, ctx):
+        """Classify the query, starting speculative retrieval alongside if enabled."""
+        if self.speculative:
+            ctx.speculation = Speculation(ctx.context)
+        try:
+            ctx.question_type, ctx.processed_query = determine_question_type(ctx.query, context=ctx.context)
+        except BaseException:
+            ctx.finish_speculation()
+            raise
+        if ctx.question_type == "out_of_scope":
+            ctx.finish_speculation()
+
+    def _build_initial_task(self, ctx):
+        try:
+            return ctx.build_initial_task()
+        finally:
+            ctx.finish_speculation()
+
+    def _refiner_task(self, ctx, initial_response):
+        return get_response_refiner_task(
+            ctx.query, initial_response, ctx.question_type,
+            rag_note=ctx.rag_note, agent=ctx.agents["response_refiner"]
+        )
+
+    def answer(self, query, ctx=None):
+        """Classify the query, run the specialist task, then refine it into the final report.
+
+        In fused mode the specialist writes the report and the refiner only runs if it fails
+        validation; out-of-scope queries get the fixed report without any LLM call.
+        Returns (question_type, report).
+        """
+        ctx = ctx or self._context(query)
+        self._classify(ctx)
+        if ctx.question_type == "out_of_scope":
+            _count_answer("templated")
+            return ctx.question_type, out_of_scope_report(ctx.query)
+        initial_task = self._build_initial_task(ctx)
+        initial_response = ctx.kickoff(initial_task)
+        if self.fused:
+            report = ctx.render_fused(str(initial_response))
+            if report is not None:
+                return ctx.question_type, report
+        _count_answer("refined")
+        return ctx.question_type, ctx.kickoff(self._refiner_task(ctx, initial_response), "refiner")
+
+    def stream(self, query):
+        """Generator variant of `run` for the UI.
+
+        Yields the text to display so far: a progress line per stage, then the report
+        growing token by token (the specialist's in fused mode, otherwise the refiner's).
+        Time to first report token and total latency are logged.
+        """
+        return traced(Trace(), self._stream(query))
+
+    def _stream(self, query):
+        start = time.perf_counter()
+        ctx = self._context(query)
+        if self.cache is not None:
+            report = self._cache_lookup(ctx)
+            if report is not None:
+                _log_latency(query, start, time.perf_counter(), cached=True)
+                yield report
+                return
+
+        yield STAGE_MESSAGES["classifying"]
+        self._classify(ctx)
+        report, first_token = None, None
+        if ctx.question_type == "out_of_scope":
+            _count_answer("templated")
+            report = out_of_scope_report(ctx.query)
+            yield report
+        else:
+            yield STAGE_MESSAGES["retrieving"]
+            initial_task = self._build_initial_task(ctx)
+            yield STAGE_MESSAGES["analyzing"]
+            if self.fused:
+                initial_response = ""
+                for chunk in ctx.stream(initial_task):
+                    first_token = first_token or time.perf_counter()
+                    initial_response += chunk
+                    yield initial_response
+                report = ctx.render_fused(initial_response)
+                if report is not None:
+                    yield report
+            else:
+                initial_response = ctx.kickoff(initial_task)
+
+        if report is None:
+            yield STAGE_MESSAGES["reporting"]
+            _count_answer("refined")
+            report = ""
+            for chunk in ctx.stream(self._refiner_task(ctx, initial_response), "refiner"):
+                first_token = first_token or time.perf_counter()
+                report += chunk
+                yield report
+        _log_latency(query, start, first_token)
+        if self.cache is not None and report:
+            self._cache_store(ctx, report)
+
+    def submit(self, query):
+        """Schedule a query on the pipeline's thread pool and return its Future."""
+        return self.executor.submit(self.run, query)
+
+    def map(self, queries):
+        """Run many queries concurrently, returning results in input order."""
+        return list(self.executor.map(self.run, queries))
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
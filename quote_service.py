@@ -0,0 +1,138 @@
+# quote_service.py
+
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http_client import TokenBucket
+from tracing import record_cache
+from utils import get_stock_data, get_daily_history, RATE_LIMIT_ERROR
+
+# Settings
+QUOTE_TTL = float(os.getenv("QUOTE_TTL", "60"))
+QUOTE_STALE_TTL = float(os.getenv("QUOTE_STALE_TTL", "3600"))
+# Alpha Vantage free tier: 5 requests per minute
+ALPHA_VANTAGE_RATE_PER_MINUTE = float(os.getenv("ALPHA_VANTAGE_RATE_PER_MINUTE", "5"))
+QUOTE_MAX_WAIT = float(os.getenv("QUOTE_MAX_WAIT", "2"))
+# Daily closes only change once per session
+HISTORY_TTL = float(os.getenv("HISTORY_TTL", "21600"))
+HISTORY_STALE_TTL = float(os.getenv("HISTORY_STALE_TTL", "259200"))
+
+class QuoteService:
+    """Rate-limit-aware front for get_stock_data.
+
+    - Quotes younger than `ttl` are served from memory.
+    - Concurrent requests for the same symbol share a single in-flight fetch.
+    - Upstream calls draw from a token bucket sized to the provider quota, waiting at most
+      `max_wait` seconds for a token. Background callers pass `reserve`, the fraction of
+      the bucket they must leave for interactive requests.
+    - When over quota (locally or upstream), the last good quote up to `stale_ttl` old is
+      returned with `stale: True` and its `age_seconds` instead of an error.
+    """
+
+    def __init__(self, fetch=get_stock_data, ttl=QUOTE_TTL, stale_ttl=QUOTE_STALE_TTL,
+                 rate_per_minute=ALPHA_VANTAGE_RATE_PER_MINUTE, max_wait=QUOTE_MAX_WAIT, bucket=None, name="quote"):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_wait = max_wait
+        # Services calling the same provider pass one bucket so they share its quota
+        self.bucket = bucket or TokenBucket(rate_per_minute, per=60.0)
+        self._quotes = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {"fresh_hits": 0, "coalesced": 0, "fetches": 0, "stale_served": 0, "throttled": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def cached(self, symbol, max_age):
+        """Return (quote, age) for a cached quote no older than max_age, or (None, None)."""
+        with self._lock:
+            entry = self._quotes.get(symbol)
+        if entry is None:
+            return None, None
+        quote, fetched_at = entry
+        age = time.time() - fetched_at
+        return (quote, age) if age <= max_age else (None, None)
+
+    def get_quote(self, symbol, max_wait=None, reserve=0.0):
+        """Return a quote dict shaped like get_stock_data's, possibly marked stale.
+
+        `max_wait` overrides how long to wait for a rate-limit token, and for a fetch of the
+        same symbol already in flight; `reserve` makes the fetch low priority (see above).
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        symbol = symbol.strip().upper()
+        quote, _ = self.cached(symbol, self.ttl)
+        if quote is not None:
+            self._count("fresh_hits")
+            record_cache(self.name, True)
+            return dict(quote)
+
+        with self._lock:
+            future = self._in_flight.get(symbol)
+            leader = future is None
+            if leader:
+                future = self._in_flight[symbol] = Future()
+        if not leader:
+            self._count("coalesced")
+            record_cache(self.name, True)
+            try:
+                return dict(future.result(timeout=max_wait))
+            except FutureTimeoutError:
+                # The leader may be a low-priority fetch still waiting for a token
+                self._count("throttled")
+                return self._stale_or_error(symbol, {"symbol": symbol, "error": RATE_LIMIT_ERROR, "rate_limited": True})
+
+        record_cache(self.name, False)
+        try:
+            result = self._fetch(symbol, max_wait, reserve)
+            future.set_result(result)
+            return dict(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(symbol, None)
+
+    def _fetch(self, symbol, max_wait, reserve=0.0):
+        if not self.bucket.acquire(timeout=max_wait, floor=reserve * self.bucket.capacity):
+            self._count("throttled")
+            return self._stale_or_error(symbol, {"symbol": symbol, "error": RATE_LIMIT_ERROR, "rate_limited": True})
+        self._count("fetches")
+        result = self.fetch(symbol)
+        if "error" not in result:
+            with self._lock:
+                self._quotes[symbol] = (result, time.time())
+            return result
+        if result.get("rate_limited"):
+            return self._stale_or_error(symbol, result)
+        return result
+
+    def _stale_or_error(self, symbol, error):
+        quote, age = self.cached(symbol, self.stale_ttl)
+        if quote is None:
+            return error
+        self._count("stale_served")
+        return dict(quote, stale=True, age_seconds=round(age))
+
+# Shared by every request in the process so the quota is enforced globally; daily history
+# comes from the same provider and draws on the same bucket
+quote_service = QuoteService()
+history_service = QuoteService(fetch=get_daily_history, ttl=HISTORY_TTL, stale_ttl=HISTORY_STALE_TTL, bucket=quote_service.bucket, name="history")
+
+def set_alpha_vantage_rate(per_minute):
+    """Replace the Alpha Vantage quota shared by quotes and daily history."""
+    quote_service.bucket = history_service.bucket = TokenBucket(per_minute, per=60.0)
+
+def get_quote(symbol, max_wait=None, reserve=0.0):
+    """Fetch a quote through the shared QuoteService."""
+    return quote_service.get_quote(symbol, max_wait=max_wait, reserve=reserve)
+
+def get_history(symbol, max_wait=None):
+    """Fetch daily closes through the shared history service, cached for HISTORY_TTL."""
+    return history_service.get_quote(symbol, max_wait=max_wait)
@@ -0,0 +1,70 @@
+# report.py
+
+import re
+
+# Fields of the final report, in display order
+REPORT_FIELDS = {"summary": "Summary", "key_insight": "Key Insight", "source": "Source/Note"}
+MAX_REPORT_WORDS = 200
+
+RAG_NOT_USED_NOTE = "Note: No relevant information found in RAG system, web search results were used."
+
+# Appended to a specialist prompt in fused mode so its answer is already the final report
+FUSED_INSTRUCTIONS = """
+        ### Output format:
+        - Write for a general audience in simple language.
+        - Reply with exactly these three lines and nothing else:
+          - **Summary**: [Simplified summary in 3-4 sentences]
+          - **Key Insight**: [One key takeaway or recommendation]
+          - **Source/Note**: [Cite source or add note]
+        - Keep the whole report under 200 words.
+        """
+FUSED_EXPECTED_OUTPUT = "Three lines starting with **Summary**:, **Key Insight**: and **Source/Note**:, under 200 words in total."
+
+_FIELD_PATTERN = re.compile(
+    r"^\s*[-*]?\s*\**\s*(Summary|Key Insight|Source/Note|Source)\s*\**\s*:\s*\**\s*(.*)$",
+    re.IGNORECASE
+)
+_LABELS = {"summary": "summary", "key insight": "key_insight", "source/note": "source", "source": "source"}
+
+def parse_report(text):
+    """Extract the report fields from a model answer.
+
+    Returns a dict keyed like REPORT_FIELDS, or None when a field is missing or empty,
+    a field appears twice, or the report runs over MAX_REPORT_WORDS.
+    """
+    fields, current = {}, None
+    for line in str(text).splitlines():
+        match = _FIELD_PATTERN.match(line)
+        if match:
+            current = _LABELS[match.group(1).lower()]
+            if current in fields:
+                return None
+            fields[current] = [match.group(2)]
+        elif current is not None and line.strip() and not line.lstrip().startswith("**Financial Report"):
+            fields[current].append(line.strip())
+    fields = {key: " ".join(part for part in parts if part).strip().strip("*").strip() for key, parts in fields.items()}
+    if set(fields) != set(REPORT_FIELDS) or not all(fields.values()):
+        return None
+    if sum(len(value.split()) for value in fields.values()) > MAX_REPORT_WORDS:
+        return None
+    return fields
+
+def render_report(query, fields, rag_note="NO_RAG_NEEDED"):
+    """Render validated fields in the refiner's report layout."""
+    source = fields["source"]
+    if rag_note == "RAG_NOT_USED" and RAG_NOT_USED_NOTE not in source:
+        source = f"{source} {RAG_NOT_USED_NOTE}"
+    return (
+        f"**Financial Report for Query: '{query}'**\n"
+        f"- **{REPORT_FIELDS['summary']}**: {fields['summary']}\n"
+        f"- **{REPORT_FIELDS['key_insight']}**: {fields['key_insight']}\n"
+        f"- **{REPORT_FIELDS['source']}**: {source}"
+    )
+
+def out_of_scope_report(query):
+    """The fixed report for queries that are not about finance."""
+    return render_report(query, {
+        "summary": "This query is not related to finance. I am designed to assist with financial topics like stock analysis, market news, or financial concepts.",
+        "key_insight": "Please try a finance-related question, such as “Analyze META stock performance” or “What is revenue?”",
+        "source": "No further processing performed as query is out of scope.",
+    })
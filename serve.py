@@ -0,0 +1,342 @@
+# serve.py
+
+import argparse
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tracing import METRICS_PORT, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# Settings
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+SERVE_HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8765"))
+SHARED_SEMANTIC_CACHE_PATH = "/tmp/semantic_cache.sqlite"
+
+def share_answer_cache():
+    """Point the answer cache at a SQLite file all workers share, unless one is configured.
+
+    pipeline reads SEMANTIC_CACHE_PATH on import, so this must run before it is imported.
+    """
+    os.environ.setdefault("SEMANTIC_CACHE_PATH", SHARED_SEMANTIC_CACHE_PATH)
+
+if SERVE_WORKERS > 1:
+    share_answer_cache()
+
+def preload():
+    """Load everything read-only and CPU-heavy before forking: the embedding model, the
+    intent classifier's seed matrix and, with VECTOR_BACKEND=local, the memory-mapped index
+    and BM25 postings. Network clients are left to each worker, since sockets must not be
+    shared across a fork. Returns warm-up timings like utils.warm_up.
+    """
+    from utils import embeddings, intent_classifier, get_vector_index, VECTOR_BACKEND
+
+    timings = {}
+    steps = [
+        ("embeddings", lambda: embeddings.embed_query("warm up")),
+        ("intent_classifier", lambda: intent_classifier.classify("warm up")),
+    ]
+    if VECTOR_BACKEND == "local":
+        steps.append(("vector_index", get_vector_index))
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+            timings[name] = time.perf_counter() - start
+        except Exception as e:
+            timings[name] = f"failed: {e}"
+    # Move preloaded objects out of the collector's reach, so that collections in the
+    # workers do not write to (and so copy) the pages they live on
+    gc.collect()
+    gc.freeze()
+    return timings
+
+def memory_usage(pid="self"):
+    """Resident and proportional set size of a process in bytes (Linux /proc).
+
+    PSS splits pages shared copy-on-write between the processes mapping them, so summing it
+    over the workers gives the real footprint of the pool.
+    """
+    usage = {}
+    for path, fields in ((f"/proc/{pid}/smaps_rollup", ("Rss", "Pss")), (f"/proc/{pid}/status", ("VmRSS",))):
+        try:
+            with open(path) as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in fields:
+                        usage[name.lower().replace("vm", "")] = int(value.split()[0]) * 1024
+        except OSError:
+            continue
+    return {"rss": usage.get("rss", 0), "pss": usage.get("pss", usage.get("rss", 0))}
+
+def limit_quotas(shares):
+    """Split the per-minute upstream quotas evenly between `shares` processes."""
+    from http_client import set_rate_limit
+    from quote_service import set_alpha_vantage_rate, ALPHA_VANTAGE_RATE_PER_MINUTE
+    from utils import UPSTREAM_RATE_LIMITS
+
+    for upstream, per_minute in UPSTREAM_RATE_LIMITS.items():
+        set_rate_limit(upstream, per_minute / shares)
+    set_alpha_vantage_rate(ALPHA_VANTAGE_RATE_PER_MINUTE / shares)
+
+def _handler(pipeline, slots):
+    class WorkerHandler(BaseHTTPRequestHandler):
+        """POST /answer streams the pipeline's output as JSON lines; GET /health reports the worker."""
+
+        def do_POST(self):
+            if self.path != "/answer":
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            query = json.loads(self.rfile.read(length) or b"{}").get("query", "")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            with slots:
+                try:
+                    for text in pipeline.stream(query):
+                        self.wfile.write((json.dumps({"text": text}) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                except Exception as e:
+                    self.wfile.write((json.dumps({"error": str(e)}) + "\n").encode("utf-8"))
+
+        def do_GET(self):
+            if self.path != "/health":
+                self.send_error(404)
+                return
+            body = json.dumps(dict(memory_usage(), pid=os.getpid())).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return WorkerHandler
+
+class WorkerPool:
+    """Pre-forked pool of pipeline worker processes behind one listening socket.
+
+    The parent binds the socket and preloads the models, then forks `workers` processes
+    that each accept connections on the inherited socket and answer with their own
+    FinancePipeline. Model weights and the local index stay shared copy-on-write; the
+    answer, LLM and embedding caches are SQLite files every worker reads and writes.
+    Upstream quotas are divided by `quota_shares` (default: one share per worker) so the
+    pool as a whole keeps to them. A worker that dies is replaced by the zygote (see start()).
+
+    Each worker serves its own /metrics on `metrics_port` + 1 + its slot (0 to workers - 1),
+    so Prometheus scrapes every worker as a separate target; a replacement keeps the slot,
+    and with it the port, of the worker it replaces. A `metrics_port` of 0 disables them.
+    """
+
+    def __init__(self, workers=SERVE_WORKERS, host=SERVE_HOST, port=SERVE_PORT, threads=None, use_cache=True, quota_shares=None,
+                 metrics_port=METRICS_PORT):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.threads = threads
+        self.use_cache = use_cache
+        self.quota_shares = quota_shares or workers
+        self.metrics_port = metrics_port
+        self.server = None
+        # pid -> slot
+        self.pids = {}
+        self.zygote = None
+        self._events = self._events_writer = None
+        self._stopping = False
+        self._supervisor = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.server.server_address[1]}"
+
+    def start(self):
+        """Bind, preload and fork the workers; call before the parent starts any threads.
+
+        The workers are forked by a zygote: a helper process forked here, while the parent
+        is still single-threaded, that does nothing but fork workers and replace those that
+        exit. Forking from a process with other threads running risks a child inheriting a
+        lock (logging, SQLite, the HTTP pool, a tokenizer) that one of them held.
+        """
+        self.server = ThreadingHTTPServer((self.host, self.port), BaseHTTPRequestHandler)
+        # Every worker accepts from this one backlog
+        self.server.socket.listen(socket.SOMAXCONN)
+        logger.info("preloaded %s", preload())
+        events, self._events_writer = os.pipe()
+        self.zygote = os.fork()
+        if not self.zygote:
+            os.close(events)
+            try:
+                self._run_zygote()
+            finally:
+                os._exit(0)
+        os.close(self._events_writer)
+        self._events = os.fdopen(events, "r", encoding="ascii")
+        # The zygote reports each worker it starts as "start <pid> <slot>"
+        while len(self.pids) < self.workers:
+            self._read_event()
+        return self
+
+    def _read_event(self):
+        """Apply one "start <pid> <slot>" or "exit <pid>" line from the zygote; False at EOF."""
+        line = self._events.readline()
+        if not line:
+            return False
+        event, pid, *slot = line.split()
+        if event == "start":
+            self.pids[int(pid)] = int(slot[0])
+        else:
+            self.pids.pop(int(pid), None)
+        return True
+
+    def _report(self, *fields):
+        try:
+            os.write(self._events_writer, (" ".join(map(str, fields)) + "\n").encode("ascii"))
+        except (BlockingIOError, BrokenPipeError):
+            # Nobody is reading (no supervise()), or the parent is gone; never block on it
+            pass
+
+    def _run_zygote(self):
+        stopping = []
+
+        def stop(*_):
+            stopping.append(True)
+            for pid in list(self.pids):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for slot in range(self.workers):
+            self._fork(slot)
+        os.set_blocking(self._events_writer, False)
+        # The zygote's only children are the workers
+        while self.pids:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            slot = self.pids.pop(pid, None)
+            if slot is None:
+                continue
+            self._report("exit", pid)
+            if not stopping:
+                logger.warning("worker %d exited, starting a replacement", pid)
+                self._fork(slot)
+
+    def _fork(self, slot):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = slot
+            self._report("start", pid, slot)
+            return
+        try:
+            os.close(self._events_writer)
+            self._run_worker(slot)
+        finally:
+            os._exit(0)
+
+    def metrics_ports(self):
+        """Metrics port of each worker slot, or an empty list when disabled."""
+        return [self.metrics_port + 1 + slot for slot in range(self.workers)] if self.metrics_port else []
+
+    def _run_worker(self, slot):
+        from pipeline import FinancePipeline, PIPELINE_WORKERS, answer_cache
+
+        signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            # Each worker gets its share of the cores instead of every one using all of them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+        limit_quotas(self.quota_shares)
+        if self.metrics_port:
+            try:
+                start_metrics_server(self.metrics_ports()[slot])
+            except OSError as e:
+                # Serving answers matters more than exporting metrics
+                logger.warning("worker %d: metrics server not started: %s", os.getpid(), e)
+        threads = self.threads or PIPELINE_WORKERS
+        pipeline = FinancePipeline(max_workers=threads, verbose=False, cache=answer_cache if self.use_cache else None)
+        self.server.RequestHandlerClass = _handler(pipeline, threading.BoundedSemaphore(threads))
+        self.server.daemon_threads = True
+        self.server.serve_forever()
+
+    def supervise(self):
+        """Keep `pids` in step with the replacements the zygote forks; runs on a daemon thread."""
+        def loop():
+            while self._read_event():
+                pass
+            if not self._stopping:
+                logger.error("worker zygote exited; dead workers are no longer replaced")
+        self._supervisor = threading.Thread(target=loop, name="worker-supervisor", daemon=True)
+        self._supervisor.start()
+        return self
+
+    def worker_memory(self):
+        return {pid: memory_usage(pid) for pid in sorted(self.pids)}
+
+    def stop(self):
+        """Stop the zygote, which stops and reaps the workers."""
+        self._stopping = True
+        try:
+            os.kill(self.zygote, signal.SIGTERM)
+            os.waitpid(self.zygote, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self.pids.clear()
+        self._events.close()
+        self.server.server_close()
+
+def stream_answer(url, query, timeout=300):
+    """Yield the text a worker streams back for `query`, like FinancePipeline.stream."""
+    from http_client import get_http_client
+
+    response = get_http_client().session.post(f"{url}/answer", json={"query": query}, stream=True, timeout=timeout)
+    response.raise_for_status()
+    with response:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            message = json.loads(line)
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            yield message["text"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the pipeline from pre-forked worker processes.")
+    parser.add_argument("--workers", type=int, default=max(2, SERVE_WORKERS), help="Worker processes.")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    share_answer_cache()
+    pool = WorkerPool(args.workers, args.host, args.port).start()
+    print(f"{args.workers} workers answering POST {pool.url}/answer")
+    if pool.metrics_ports():
+        print(f"worker metrics on ports {', '.join(map(str, pool.metrics_ports()))}")
+    pool.supervise()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+
+if __name__ == "__main__":
+    main()
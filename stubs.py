@@ -0,0 +1,181 @@
+# stubs.py
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-ins for every upstream, used by `benchmark.py offline`. Nothing here is
+# imported by the app itself.
+
+SAMPLE_CHUNKS = [
+    ("Basics.pdf", "Revenue is the total amount of income generated by the sale of goods or services related to a company's primary operations."),
+    ("Basics.pdf", "A bull market is a period of rising prices and investor optimism, while a bear market is a sustained decline of 20% or more."),
+    ("Basics.pdf", "Diversification spreads investments across assets so that the poor performance of one holding has a limited effect on the portfolio."),
+    ("Basics.pdf", "Compound interest is interest calculated on the initial principal and on the accumulated interest of previous periods."),
+    ("Financialterms.pdf", "The price-to-earnings (P/E) ratio divides a company's share price by its earnings per share and is used to compare valuations."),
+    ("Financialterms.pdf", "EBITDA stands for earnings before interest, taxes, depreciation and amortization, a proxy for operating cash generation."),
+    ("Financialterms.pdf", "A dividend yield is the annual dividend per share divided by the share price, expressed as a percentage."),
+    ("Financialterms.pdf", "The balance of payments records all economic transactions between residents of a country and the rest of the world."),
+    ("Statementanalysis.pdf", "The balance sheet lists a company's assets, liabilities and shareholders' equity at a point in time."),
+    ("Statementanalysis.pdf", "The cash flow statement reports cash generated and used by operating, investing and financing activities."),
+    ("Statementanalysis.pdf", "Working capital is current assets minus current liabilities and measures short-term liquidity."),
+    ("Statementanalysis.pdf", "Return on equity is net income divided by shareholders' equity and shows how efficiently equity is used."),
+]
+
+def _digest(text):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+def fake_llm_answer(messages):
+    """Deterministic reply that satisfies whichever prompt it is given."""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    if "Is Finance Related" in prompt:
+        return "Is Finance Related: Yes\nCategory: finance_knowledge\nExtra Data: benchmark query"
+    if "Category:" in prompt:
+        return "Category: finance_knowledge\nExtra Data: benchmark query"
+    seed = _digest(prompt) % 1000
+    return (
+        f"- **Summary**: This is a deterministic benchmark answer number {seed}. It stands in for the model output "
+        "with a report of realistic length, covering the concept, its context and a short example for investors.\n"
+        "- **Key Insight**: Compare the figure with peers and its own history before drawing conclusions.\n"
+        "- **Source/Note**: Based on Basics.pdf and web search."
+    )
+
+class FakeLLM:
+    """Replaces litellm.completion, which both CrewAI and the streaming path call, with a
+    deterministic answer after a fixed latency.
+
+    Non-streaming calls go through litellm's own `mock_response`, so CrewAI receives a real
+    response object; streaming calls yield word chunks spread over the same latency.
+    """
+
+    def __init__(self, latency=0.5, tokens_per_second=200.0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._original = None
+
+    def completion(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        text = fake_llm_answer(kwargs.get("messages") or (args[1] if len(args) > 1 else []))
+        if kwargs.get("stream"):
+            return self._stream(text)
+        time.sleep(self.latency)
+        kwargs.pop("api_key", None)
+        # CrewAI's agent parser expects the ReAct final-answer marker
+        text = f"Thought: I now know the final answer\nFinal Answer: {text}"
+        return self._original(*args, **dict(kwargs, mock_response=text))
+
+    def _stream(self, text):
+        words = text.split(" ")
+        first = self.latency - len(words) / self.tokens_per_second
+        time.sleep(max(0.0, first))
+        for i, word in enumerate(words):
+            time.sleep(1.0 / self.tokens_per_second)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word if i == 0 else " " + word))])
+
+    def install(self):
+        import litellm
+
+        self._original = litellm.completion
+        litellm.completion = self.completion
+        return self
+
+    def uninstall(self):
+        import litellm
+
+        if self._original is not None:
+            litellm.completion = self._original
+
+def _daily_series(symbol, price, sessions=100):
+    """A deterministic random walk of daily closes ending at `price`, keyed by date."""
+    import datetime
+    import numpy as np
+
+    rng = np.random.default_rng(_digest(symbol))
+    closes = np.exp(np.cumsum(rng.normal(0.0005, 0.015, sessions)))
+    closes *= price / closes[-1]
+    last = datetime.date(2024, 1, 2)
+    return {
+        (last - datetime.timedelta(days=sessions - 1 - i)).isoformat(): {"4. close": f"{close:.4f}"}
+        for i, close in enumerate(closes)
+    }
+
+def _stub_handler(latency):
+    class StubHandler(BaseHTTPRequestHandler):
+        """Serper /search and Alpha Vantage /query (GLOBAL_QUOTE, TIME_SERIES_DAILY) responses in the real payload shapes."""
+
+        def _reply(self, payload):
+            time.sleep(latency)
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            query = request.get("q", "")
+            self._reply({"organic": [
+                {"title": f"Market update {i + 1} on {query}", "link": f"https://news.example/{_digest(query)}/{i}",
+                 "snippet": f"Analysts discussed {query} in story {i + 1}, pointing to earnings, rates and sector rotation."}
+                for i in range(int(request.get("num", 3)))
+            ]})
+
+        def do_GET(self):
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            symbol = params.get("symbol", "XYZ")
+            price = 50 + _digest(symbol) % 400
+            if params.get("function") == "TIME_SERIES_DAILY":
+                self._reply({"Time Series (Daily)": _daily_series(symbol, price)})
+                return
+            self._reply({"Global Quote": {
+                "01. symbol": symbol, "05. price": f"{price:.4f}", "09. change": "1.2500", "10. change percent": "0.8000%",
+            }})
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+class StubUpstreamServer:
+    """Threaded local HTTP server answering for Serper and Alpha Vantage.
+
+    Point SERPER_URL and ALPHA_VANTAGE_URL at `url` before utils is imported.
+    """
+
+    def __init__(self, latency=0.05):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _stub_handler(latency))
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-upstream", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def build_sample_index(path, embeddings):
+    """Write a local vector index and BM25 index over SAMPLE_CHUNKS to `path`."""
+    from bm25 import BM25Index
+    from ingest import chunk_id
+    from vector_index import LocalVectorIndex
+
+    sources = [source for source, _ in SAMPLE_CHUNKS]
+    texts = [text for _, text in SAMPLE_CHUNKS]
+    # The same uuid5 ids for both indexes, as ingest.py writes them, so fusion matches hits up
+    ids = [chunk_id(source, 0, i) for i, source in enumerate(sources)]
+    LocalVectorIndex.build(path, texts, sources, embeddings, ids=ids)
+    BM25Index.from_chunks([
+        {"id": cid, "text": text, "source": source} for cid, source, text in zip(ids, sources, texts)
+    ]).write(path)
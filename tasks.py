@@ -1,17 +1,148 @@
 # tasks.py
 
-from utils import search_qdrant, search_news, get_stock_data
+import threading
+from quote_service import get_quote, get_history
+from indicators import summarize, format_summary
+from utils import (
+    search_qdrant, rag_is_sufficient, rag_is_confident, search_news, fan_out, io_executor,
+    QDRANT_DEADLINE, NEWS_DEADLINE, STOCK_DEADLINE, WEB_SEARCH_MODE, WEB_RACE_DEADLINE
+)
+from tracing import record_web_search, submit_in_context
 from crewai import Task
-from agents import finance_knowledge_agent, market_news_agent, stock_analysis_agent, response_refiner_agent
+from agents import create_agent
+from context_packer import pack_context, record_prompt_usage, estimate_tokens, RAG_TOKEN_BUDGET, WEB_TOKEN_BUDGET
+from report import FUSED_INSTRUCTIONS, FUSED_EXPECTED_OUTPUT, out_of_scope_report
 
-def get_finance_knowledge_task(query):
+# Returned in place of a source that fails or misses its deadline
+NEWS_TIMEOUT_RESULT = [{"title": "Timeout Error", "url": "", "snippet": "News API request timed out. Please try again later."}]
+
+# Deadline of quote and daily-history fetches; batch runs raise it to cover their quote wait
+_stock_deadline = STOCK_DEADLINE
+
+def set_stock_deadline(seconds):
+    """Replace the deadline of quote and daily-history fetches."""
+    global _stock_deadline
+    _stock_deadline = seconds
+
+# What happened to the web search of each knowledge query, over the process lifetime
+_web_search_stats = {"searched": 0, "skipped": 0, "raced": 0, "dropped": 0}
+_web_search_lock = threading.Lock()
+
+def _record_web_search(outcome):
+    with _web_search_lock:
+        _web_search_stats[outcome] = _web_search_stats.get(outcome, 0) + 1
+    record_web_search(outcome)
+
+def get_web_search_stats():
+    """Return web search outcomes of knowledge queries and how many Serper calls were avoided.
+
+    "searched": the chunks were weak (or WEB_SEARCH_MODE=always) and the web was used;
+    "skipped": confident chunks, no call made (or the early call cancelled before it started);
+    "raced"/"dropped": confident chunks, and the call fired early finished inside
+    WEB_RACE_DEADLINE or was dropped as late.
+    """
+    with _web_search_lock:
+        stats = dict(_web_search_stats)
+    total = sum(stats.values())
+    stats["serper_calls_avoided"] = stats["skipped"]
+    stats["skip_rate"] = (stats["skipped"] + stats["dropped"]) / total if total else 0.0
+    return stats
+
+def gather_finance_knowledge_sources(query, prefetched=None, context=None, mode=WEB_SEARCH_MODE):
+    """Fetch document chunks and, unless the chunks already answer the query, web results.
+
+    With a QueryContext, chunks come from its once-per-request search. In "race" mode (the
+    default) both start together, and with confident chunks the web search is cancelled if
+    it has not started yet, or awaited for at most WEB_RACE_DEADLINE; in "skip" mode the
+    chunks are fetched first and Serper is only called when they are not confident, at the
+    cost of a sequential search for weak ones; "always" fetches both concurrently.
+    `web_search` in the result names the outcome.
+    """
+    search = (context.search, (3,)) if context is not None else (search_qdrant, (query, 3))
+    contexts_call = (*search, QDRANT_DEADLINE, [])
+    web_call = (search_news, (query, 3), NEWS_DEADLINE, NEWS_TIMEOUT_RESULT)
+    if mode == "always":
+        sources = fan_out({"contexts": contexts_call, "web_results": web_call}, prefetched=prefetched)
+        _record_web_search("searched")
+        return dict(sources, web_search="searched")
+
+    web_future = submit_in_context(io_executor, search_news, query, 3) if mode == "race" else None
+    contexts = fan_out({"contexts": contexts_call}, prefetched=prefetched)["contexts"]
+    in_flight = {"web_results": web_future} if web_future is not None else None
+    if not rag_is_confident(contexts):
+        outcome = "searched"
+        web_results = fan_out({"web_results": web_call}, prefetched=in_flight)["web_results"]
+    elif web_future is None or web_future.cancel():
+        outcome = "skipped"
+        web_results = []
+    else:
+        web_results = fan_out({"web_results": (search_news, (query, 3), WEB_RACE_DEADLINE, None)}, prefetched=in_flight)["web_results"]
+        outcome = "dropped" if web_results is None else "raced"
+        web_results = web_results or []
+    _record_web_search(outcome)
+    return {"contexts": contexts, "web_results": web_results, "web_search": outcome}
+
+def _stock_timeout(symbol):
+    return {"symbol": symbol, "error": "Stock API request timed out. Please try again later."}
+
+def gather_stock_sources(symbol, prefetched=None):
+    """Fetch the quote, daily history and related news for a stock concurrently."""
+    return fan_out({
+        "stock_data": (get_quote, (symbol,), _stock_deadline, _stock_timeout(symbol)),
+        "history": (get_history, (symbol,), _stock_deadline, _stock_timeout(symbol)),
+        "news": (search_news, (f"{symbol} stock", 3), NEWS_DEADLINE, NEWS_TIMEOUT_RESULT),
+    }, prefetched=prefetched)
+
+def gather_comparison_sources(symbols):
+    """Fetch the daily history of every symbol and news about the group, all concurrently.
+
+    The latest close stands in for a live quote, which keeps a comparison to one Alpha
+    Vantage call per symbol. Symbols after the first that Alpha Vantage does not know
+    are left out of "symbols".
+    """
+    calls = {symbol: (get_history, (symbol,), _stock_deadline, _stock_timeout(symbol)) for symbol in symbols}
+    calls["news"] = (search_news, (f"{' '.join(symbols)} stock", 3), NEWS_DEADLINE, NEWS_TIMEOUT_RESULT)
+    sources = fan_out(calls)
+    known = [symbol for i, symbol in enumerate(symbols) if i == 0 or not sources[symbol].get("not_found")]
+    return {"symbols": known, "histories": {symbol: sources[symbol] for symbol in known}, "news": sources["news"]}
+
+def indicator_text(history):
+    """Indicator summary of a daily history for the prompt, or why there is none."""
+    if "error" in history:
+        return f"Technical indicators unavailable: {history['error']}"
+    text = format_summary(summarize(history["closes"]))
+    if history.get("stale"):
+        text += f"\nNote: daily history is {history['age_seconds'] // 3600} hours old."
+    return text
+
+def _render_chunk(ctx):
+    return f"Source: {ctx['source']}\nContent: {ctx['text']}"
+
+def _render_snippet(item):
+    return f"Title: {item['title']}\nSummary: {item['snippet']}"
+
+def _pack_news(news):
+    return pack_context(news, WEB_TOKEN_BUDGET, text_key="snippet", render=_render_snippet)
+
+def _specialist_task(prompt, agent, expected_output, fused):
+    """Build a specialist task; in fused mode it writes the final report itself."""
+    if fused:
+        prompt += FUSED_INSTRUCTIONS
+        expected_output = FUSED_EXPECTED_OUTPUT
+    return Task(description=prompt, agent=agent, expected_output=expected_output)
+
+def get_finance_knowledge_task(query, agent=None, sources=None, fused=False):
     """Task for answering general finance knowledge questions."""
-    contexts = search_qdrant(query, top_k=3)
-    context_text = "\n\n".join([f"Source: {ctx['source']}\nContent: {ctx['text']}" for ctx in contexts])
-    is_context_useful = len(context_text) > 50 and any(query.lower() in ctx["text"].lower() for ctx in contexts)
+    sources = sources or gather_finance_knowledge_sources(query)
+    rag = pack_context(sources["contexts"], RAG_TOKEN_BUDGET, render=_render_chunk)
+    context_text = rag["text"]
+    is_context_useful = rag_is_sufficient(sources["contexts"])
 
-    web_results = search_news(query, max_results=3)
-    web_text = "\n\n".join([f"Title: {item['title']}\nSummary: {item['snippet']}" for item in web_results]) if web_results else "No additional info from the web."
+    web = _pack_news(sources["web_results"])
+    if sources.get("web_search") in ("skipped", "dropped"):
+        web_text = "Not searched; the documents above cover this query."
+    else:
+        web_text = web["text"] or "No additional info from the web."
 
     if is_context_useful:
         prompt = f"""
@@ -48,16 +179,19 @@ def get_finance_knowledge_task(query):
         - Cite your sources (e.g., "Based on web search").
         - Keep the response concise, under 200 words.
         """
-    return Task(
-        description=prompt,
-        agent=finance_knowledge_agent,
-        expected_output="A concise explanation of the financial concept, with an example and cited sources, under 200 words."
+    record_prompt_usage("finance_knowledge", prompt, {"rag": rag["tokens"], "web": web["tokens"]})
+    return _specialist_task(
+        prompt,
+        agent or create_agent("finance_knowledge"),
+        "A concise explanation of the financial concept, with an example and cited sources, under 200 words.",
+        fused
     )
 
-def get_market_news_task(query):
+def get_market_news_task(query, agent=None, fused=False):
     """Task for summarizing and analyzing market news."""
-    news = search_news(query, max_results=3)
-    news_text = "\n\n".join([f"Title: {item['title']}\nSummary: {item['snippet']}" for item in news]) if news else "No recent news found."
+    news = fan_out({"news": (search_news, (query, 3), NEWS_DEADLINE, NEWS_TIMEOUT_RESULT)})["news"]
+    packed_news = _pack_news(news)
+    news_text = packed_news["text"] or "No recent news found."
 
     prompt = f"""
     User query: '{query}'
@@ -74,15 +208,21 @@ def get_market_news_task(query):
     - Cite the news sources (e.g., "According to [title]").
     - Keep the response concise, under 200 words.
     """
-    return Task(
-        description=prompt,
-        agent=market_news_agent,
-        expected_output="A concise summary of market news, highlighting trends, with an actionable insight, under 200 words."
+    record_prompt_usage("market_news", prompt, {"news": packed_news["tokens"]})
+    return _specialist_task(
+        prompt,
+        agent or create_agent("market_news"),
+        "A concise summary of market news, highlighting trends, with an actionable insight, under 200 words.",
+        fused
     )
 
-def get_stock_analysis_task(symbol):
+def get_stock_analysis_task(symbol, agent=None, sources=None, fused=False):
     """Task for analyzing a specific stock with basic technical insights."""
-    stock_data = get_stock_data(symbol)
+    sources = sources or gather_stock_sources(symbol)
+    stock_data = sources["stock_data"]
+    packed_news = _pack_news(sources["news"])
+    news_text = packed_news["text"] or "No related news found."
+    indicators = indicator_text(sources.get("history") or {"error": "No daily history was fetched."})
     if "error" in stock_data:
         prompt = f"""
         User query: 'Analyze {symbol}'
@@ -91,35 +231,80 @@ def get_stock_analysis_task(symbol):
 
         Error: {stock_data['error']}
 
+        {indicators}
+
+        Related News:
+        {news_text}
+
         ### Instructions:
-        - Provide a general overview of the stock based on your knowledge.
+        - Provide a general overview of the stock based on your knowledge and the related news.
         - Suggest a potential reason for the error.
         - Recommend an action for the user.
         - Keep the response concise, under 200 words.
         """
     else:
         data_text = f"Price: {stock_data['price']}\nChange: {stock_data['change']} ({stock_data['change_percent']})"
+        if stock_data.get("stale"):
+            data_text += f"\nNote: live quotes are rate-limited; this quote is {stock_data['age_seconds'] // 60} minutes old."
         prompt = f"""
         User query: 'Analyze {symbol}'
 
-        You are a Stock Analysis Expert. Analyze the following stock data with basic technical insights:
+        You are a Stock Analysis Expert. Analyze the following stock data and the technical indicators computed from its daily closes:
 
         Stock Data:
         {data_text}
 
+        {indicators}
+
+        Related News:
+        {news_text}
+
         ### Instructions:
-        - Interpret the stock's performance and identify any price trend (e.g., upward/downward movement).
-        - Identify potential factors influencing the stock (e.g., market trends, sector performance).
+        - Interpret the stock's performance and trend from the indicators above (moving average crossovers, RSI, MACD, Bollinger position, volatility, drawdown); do not invent figures that are not given.
+        - Identify potential factors influencing the stock (e.g., market trends, sector performance, related news).
         - Provide an investment recommendation (e.g., "Hold", "Buy", "Sell") with a brief rationale.
         - Keep the response concise, under 200 words.
         """
-    return Task(
-        description=prompt,
-        agent=stock_analysis_agent,
-        expected_output="A concise analysis of the stock's performance with an investment recommendation, under 150 words."
+    record_prompt_usage("stock_analysis", prompt, {"news": packed_news["tokens"], "indicators": estimate_tokens(indicators)})
+    return _specialist_task(
+        prompt,
+        agent or create_agent("stock_analysis"),
+        "A concise analysis of the stock's performance with an investment recommendation, under 150 words.",
+        fused
     )
 
-def get_response_refiner_task(query, initial_response, question_type, rag_note="NO_RAG_NEEDED"):
+def get_stock_comparison_task(symbols, agent=None, sources=None, fused=False):
+    """Task for comparing several stocks on the indicators computed from their daily closes."""
+    sources = sources or gather_comparison_sources(symbols)
+    symbols = sources["symbols"]
+    packed_news = _pack_news(sources["news"])
+    news_text = packed_news["text"] or "No related news found."
+    indicators = "\n\n".join(f"{symbol}:\n{indicator_text(sources['histories'][symbol])}" for symbol in symbols)
+    prompt = f"""
+    User query: 'Compare {', '.join(symbols)}'
+
+    You are a Stock Analysis Expert. Compare the following stocks using the technical indicators computed from their daily closes:
+
+    {indicators}
+
+    Related News:
+    {news_text}
+
+    ### Instructions:
+    - Compare the stocks' trend, momentum (RSI, MACD), volatility and drawdown using only the figures above.
+    - Point out which stock looks strongest and which weakest technically, and why.
+    - Provide an investment recommendation (e.g., "Hold", "Buy", "Sell") for each stock with a brief rationale.
+    - Keep the response concise, under 200 words.
+    """
+    record_prompt_usage("stock_comparison", prompt, {"news": packed_news["tokens"], "indicators": estimate_tokens(indicators)})
+    return _specialist_task(
+        prompt,
+        agent or create_agent("stock_analysis"),
+        "A concise comparison of the stocks' technical picture with a recommendation for each, under 200 words.",
+        fused
+    )
+
+def get_response_refiner_task(query, initial_response, question_type, rag_note="NO_RAG_NEEDED", agent=None):
     """Task for refining and reporting the response."""
     
     # Create a special note for RAG information
@@ -152,12 +337,7 @@ def get_response_refiner_task(query, initial_response, question_type, rag_note="
           - **Source/Note**: [Add note indicating no further processing]
         - Keep under 200 words.
         """
-        expected_output = f"""
-        **Financial Report for Query: '{query}'**
-        - **Summary**: This query is not related to finance. I am designed to assist with financial topics like stock analysis, market news, or financial concepts.
-        - **Key Insight**: Please try a finance-related question, such as “Analyze META stock performance” or “What is revenue?”
-        - **Source/Note**: No further processing performed as query is out of scope.
-        """
+        expected_output = out_of_scope_report(query)
     else:
         prompt = f"""
         User query: '{query}'
@@ -179,9 +359,10 @@ def get_response_refiner_task(query, initial_response, question_type, rag_note="
         - Keep under 200 words.
         """
         expected_output = "A simplified and professionally formatted report, under 200 words."
+        record_prompt_usage("response_refiner", prompt, {"draft": estimate_tokens(str(initial_response))})
     
     return Task(
         description=prompt,
-        agent=response_refiner_agent,
+        agent=agent or create_agent("response_refiner"),
         expected_output=expected_output
     )
\ No newline at end of file
@@ -0,0 +1,94 @@
+# ticker.py
+
+import html
+import os
+import threading
+import time
+from quote_service import get_quote
+
+# Settings
+TICKER_SYMBOLS = ["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA", "JPM", "BAC", "WMT"]
+# One refresh fetches every symbol, so keep TICKER_INTERVAL well inside the quote quota
+TICKER_INTERVAL = float(os.getenv("TICKER_INTERVAL", "600"))
+TICKER_UI_INTERVAL = float(os.getenv("TICKER_UI_INTERVAL", "30"))
+# Fraction of the quote bucket the ticker leaves for user requests: it only takes a token
+# while more than this would remain, so a refresh never drains the quota users need
+TICKER_QUOTA_RESERVE = float(os.getenv("TICKER_QUOTA_RESERVE", "0.6"))
+
+class TickerRefresher:
+    """Single background thread that refreshes the ticker quotes on a fixed interval.
+
+    Every UI session renders the latest in-memory snapshot, so upstream cost depends only
+    on the interval, never on the number of connected users. A symbol whose fetch fails
+    keeps its previous value.
+    """
+
+    def __init__(self, symbols=TICKER_SYMBOLS, interval=TICKER_INTERVAL, reserve=TICKER_QUOTA_RESERVE):
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.reserve = reserve
+        self.snapshot = {}
+        self.updated_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Fetch every symbol as one batch and publish the new snapshot atomically.
+
+        Fetches run on this thread, pacing themselves on the quote service's token bucket
+        instead of tying up the request I/O pool, at low priority (see TICKER_QUOTA_RESERVE).
+        """
+        max_wait = self.interval / max(1, len(self.symbols))
+        results = {}
+        for symbol in self.symbols:
+            quote = get_quote(symbol, max_wait=max_wait, reserve=self.reserve)
+            if "error" not in quote:
+                results[symbol] = quote
+        with self._lock:
+            self.snapshot = dict(self.snapshot, **results)
+            self.updated_at = time.time()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ticker-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def render_html(self):
+        """Render the current snapshot as the ticker tape markup used by app.py."""
+        with self._lock:
+            snapshot = self.snapshot
+        items = []
+        for symbol in self.symbols:
+            quote = snapshot.get(symbol)
+            change = (quote or {}).get("change_percent", "")
+            if not quote or change in ("", "N/A"):
+                items.append(f'<span class="stock-symbol">{symbol} <span>--</span></span>')
+                continue
+            change = change.rstrip("%")
+            try:
+                direction = "down" if float(change) < 0 else "up"
+                change = f"{float(change):+.2f}%"
+            except ValueError:
+                direction, change = "up", html.escape(change)
+            items.append(f'<span class="stock-symbol">{symbol} <span class="{direction}">{change}</span></span>')
+        return (
+            '<div class="ticker-tape">\n    <div class="ticker-content">\n        '
+            + "\n        ".join(items)
+            + "\n    </div>\n</div>\n"
+        )
+
+# One refresher per process, shared by every session
+ticker_refresher = TickerRefresher()
@@ -0,0 +1,255 @@
+# tracing.py
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("tracing")
+
+# Settings
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# Loopback by default; set METRICS_HOST=0.0.0.0 to let a Prometheus on another host scrape
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic counter with a fixed set of labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of labels."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+_metrics = []
+
+STAGE_SECONDS = Histogram("finance_stage_duration_seconds", "Duration of each pipeline stage; stage=\"request\" is end to end.", ("stage", "question_type"))
+STAGE_ERRORS = Counter("finance_stage_errors_total", "Stages that raised.", ("stage",))
+LLM_CALLS = Counter("finance_llm_calls_total", "LLM calls per call site.", ("call_site", "model"))
+LLM_TOKENS = Counter("finance_llm_tokens_total", "LLM tokens per call site, split into prompt and completion.", ("call_site", "model", "kind"))
+CACHE_LOOKUPS = Counter("finance_cache_lookups_total", "Cache lookups by cache and outcome.", ("cache", "result"))
+WEB_SEARCHES = Counter("finance_knowledge_web_searches_total", "Web search decisions for knowledge queries.", ("outcome",))
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class Trace:
+    """Spans and flags of one request, identified by a short random request ID."""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.question_type = "unknown"
+        self.flags = {}
+        self.spans = []
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def finish(self, error=None):
+        """Record the end-to-end latency and log a summary line of the whole request."""
+        seconds = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(seconds, stage="request", question_type=self.question_type)
+        with self._lock:
+            stages = {}
+            for record in self.spans:
+                stages[record["stage"]] = round(stages.get(record["stage"], 0.0) + record["ms"], 1)
+        summary = {"request_id": self.request_id, "stage": "request", "question_type": self.question_type,
+                   "ms": round(seconds * 1000, 1), "stages_ms": stages, **self.flags}
+        if error is not None:
+            summary["error"] = error
+        logger.info(json.dumps(summary))
+
+_current = contextvars.ContextVar("trace", default=None)
+
+def start_trace():
+    """Create a Trace and make it current for this thread (and work submitted from it)."""
+    trace = Trace()
+    _current.set(trace)
+    return trace
+
+def bind(trace):
+    _current.set(trace)
+
+def current_trace():
+    return _current.get()
+
+def set_question_type(question_type):
+    trace = _current.get()
+    if trace is not None:
+        trace.question_type = question_type
+
+@contextmanager
+def span(stage, **attrs):
+    """Time a stage of the current request.
+
+    Yields a dict the caller may add attributes to; the span is logged as one JSON line
+    and observed in the per-stage, per-question-type latency histogram.
+    """
+    trace = _current.get()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        question_type = trace.question_type if trace is not None else "unknown"
+        STAGE_SECONDS.observe(seconds, stage=stage, question_type=question_type)
+        record = {"request_id": trace.request_id if trace is not None else None, "stage": stage,
+                  "ms": round(seconds * 1000, 1), **attrs}
+        if error is not None:
+            record["error"] = error
+        if trace is not None:
+            trace.add_span(record)
+        logger.info(json.dumps(record, default=str))
+
+def record_llm_call(call_site, model, usage=None, attrs=None):
+    """Count an LLM call and its tokens.
+
+    `usage` is any object with prompt_tokens and completion_tokens (CrewAI's UsageMetrics,
+    litellm's Usage); token counts are also added to the span `attrs` if given.
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    LLM_CALLS.inc(call_site=call_site, model=model)
+    LLM_TOKENS.inc(prompt_tokens, call_site=call_site, model=model, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, call_site=call_site, model=model, kind="completion")
+    if attrs is not None:
+        attrs.update(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+def record_cache(cache, hit):
+    """Count a cache lookup and flag the outcome on the current request."""
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+    trace = _current.get()
+    if trace is not None:
+        trace.flags[f"{cache}_cache_hit"] = hit
+
+def record_web_search(outcome):
+    """Count what happened to a knowledge query's web search and flag it on the current request."""
+    WEB_SEARCHES.inc(outcome=outcome)
+    trace = _current.get()
+    if trace is not None:
+        trace.flags["web_search"] = outcome
+
+def submit_in_context(executor, fn, *args):
+    """executor.submit that carries the current request's trace into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def traced(trace, generator):
+    """Iterate `generator` with `trace` bound for every step, then finish the trace.
+
+    UI frameworks may advance a generator from a different thread on every step, so the
+    binding cannot rely on the thread that created it.
+    """
+    error = None
+    try:
+        while True:
+            bind(trace)
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            yield item
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        generator.close()
+        trace.finish(error=error)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics on `host`:`port` from a daemon thread; port 0 disables it."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,13 +1,23 @@
 # utils.py
 
+import asyncio
 import os
+import re
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_qdrant import QdrantVectorStore
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from crewai import Agent, Task, Crew, Process, LLM
-import requests
 from requests.exceptions import ConnectionError, Timeout, HTTPError
 from functools import lru_cache
+from intent import IntentClassifier
+from vector_index import QdrantIndex, LocalVectorIndex, HybridIndex
+from bm25 import BM25Index
+from http_client import get_http_client, get_async_http_client, rate_limit, set_rate_limit
+from tracing import span, record_llm_call, record_cache, current_trace, set_question_type, submit_in_context
+from llm_cache import llm_cache, task_prompt
+from embedding_cache import EmbeddingCache, CachedEmbeddings, EMBEDDING_CACHE_DIR
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,118 +26,649 @@ load_dotenv()
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 COLLECTION_NAME = "finance-chatbot"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
+# Vector search backend: "qdrant" (hosted collection) or "local" (in-process index in LOCAL_INDEX_DIR)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "index")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 ALPHA_VANTAGE_API_KEY = os.getenv("ALPHA_VANTAGE_API_KEY")
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
+# Upstream base URLs; override to point at a local stub server
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev").rstrip("/")
+ALPHA_VANTAGE_URL = os.getenv("ALPHA_VANTAGE_URL", "https://www.alphavantage.co").rstrip("/")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+# Per-source deadlines (seconds) for concurrent retrieval
+QDRANT_DEADLINE = float(os.getenv("QDRANT_DEADLINE", "5"))
+NEWS_DEADLINE = float(os.getenv("NEWS_DEADLINE", "10"))
+STOCK_DEADLINE = float(os.getenv("STOCK_DEADLINE", "10"))
+# Calls per minute per upstream, 0 for no limit (Alpha Vantage is paced by quote_service)
+UPSTREAM_RATE_LIMITS = {
+    "serper": float(os.getenv("SERPER_RATE_PER_MINUTE", "0")),
+    "gemini": float(os.getenv("GEMINI_RATE_PER_MINUTE", "0")),
+    "mistral": float(os.getenv("MISTRAL_RATE_PER_MINUTE", "0")),
+}
+for _upstream, _per_minute in UPSTREAM_RATE_LIMITS.items():
+    set_rate_limit(_upstream, _per_minute)
+# Chunks fetched once per request; stages needing fewer get a slice of the same result
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+# Retrieved chunks count as sufficient when the best cosine similarity (all-MiniLM-L6-v2)
+# or the best BM25 keyword score (fraction of the query terms' maximum) reaches these.
+# The defaults are hand-picked starting points, not measured: MiniLM rarely scores unrelated
+# text above 0.5. Calibrate them for your index with `python evaluate_retrieval.py`, which
+# sweeps both against a labelled relevance set and suggests these and the WEB_SKIP_* pair
+RAG_SIMILARITY_THRESHOLD = float(os.getenv("RAG_SIMILARITY_THRESHOLD", "0.5"))
+RAG_KEYWORD_THRESHOLD = float(os.getenv("RAG_KEYWORD_THRESHOLD", "0.6"))
+# Knowledge queries whose chunks clear these stricter thresholds are answered without the web:
+# "race" starts Serper alongside the chunk search, so weak chunks never wait for it twice, and
+# waits at most WEB_RACE_DEADLINE seconds for it once confident chunks are in; "skip" saves the
+# call for confident chunks but searches only after them; "always" searches for every query
+WEB_SEARCH_MODE = os.getenv("WEB_SEARCH_MODE", "race").lower()
+WEB_SKIP_SIMILARITY_THRESHOLD = float(os.getenv("WEB_SKIP_SIMILARITY_THRESHOLD", "0.65"))
+WEB_SKIP_KEYWORD_THRESHOLD = float(os.getenv("WEB_SKIP_KEYWORD_THRESHOLD", "0.85"))
+WEB_RACE_DEADLINE = float(os.getenv("WEB_RACE_DEADLINE", "0.3"))
 
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings(model_name='all-MiniLM-L6-v2', cache_folder="/tmp")
+# Lazily built, thread-safe singletons: importing this module does no model loading or network I/O
+_singletons = {}
+_singleton_locks = {}
+_singleton_locks_guard = threading.Lock()
 
-# Connect to the existing Qdrant collection
-qdrant = QdrantVectorStore.from_existing_collection(
-    embedding=embeddings,
-    url=QDRANT_URL,
-    api_key=QDRANT_API_KEY,
-    collection_name=COLLECTION_NAME
-)
+def _singleton(name, factory):
+    """Build `name` with `factory` on first use; concurrent callers wait for the same instance.
+
+    A failed build is not cached, so e.g. a Qdrant outage is retried on the next call.
+    """
+    instance = _singletons.get(name)
+    if instance is not None:
+        return instance
+    with _singleton_locks_guard:
+        lock = _singleton_locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _singletons:
+            _singletons[name] = factory()
+        return _singletons[name]
+
+def get_embeddings():
+    """Return the shared all-MiniLM-L6-v2 embedding model, behind the on-disk embedding
+    cache unless EMBEDDING_CACHE_DIR is empty."""
+    def build():
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, cache_folder="/tmp")
+        if not EMBEDDING_CACHE_DIR:
+            return model
+        return CachedEmbeddings(model, EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL, EMBEDDING_DIMENSION))
+    return _singleton("embeddings", build)
+
+def get_qdrant():
+    """Return the vector store connected to the existing Qdrant collection."""
+    def build():
+        from langchain_qdrant import QdrantVectorStore
+        return QdrantVectorStore.from_existing_collection(
+            embedding=get_embeddings(),
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY,
+            collection_name=COLLECTION_NAME
+        )
+    return _singleton("qdrant", build)
+
+def get_bm25_index():
+    """Return the BM25 index written by ingest.py, or None if there is none or hybrid retrieval is off."""
+    def build():
+        if not HYBRID_RETRIEVAL or not BM25Index.exists(LOCAL_INDEX_DIR):
+            return None
+        return BM25Index.load(LOCAL_INDEX_DIR)
+    return _singleton("bm25_index", build)
+
+def get_vector_index():
+    """Return the configured search backend; all of them expose search(query, top_k, vector=None).
+
+    With a BM25 index available, vector hits are fused with keyword hits.
+    """
+    if VECTOR_BACKEND == "local":
+        index = _singleton("local_index", lambda: LocalVectorIndex(LOCAL_INDEX_DIR, embeddings))
+    else:
+        index = _singleton("qdrant_index", lambda: QdrantIndex(get_qdrant()))
+    bm25 = get_bm25_index()
+    if bm25 is None:
+        return index
+    return _singleton(f"hybrid_{VECTOR_BACKEND}_index", lambda: HybridIndex(index, bm25))
+
+def get_mistral_llm():
+    """Return the Mistral LLM used for query classification."""
+    return _singleton("mistral_llm", lambda: LLM(model="mistral/mistral-large-latest", api_key=MISTRAL_API_KEY, temperature=0.7))
+
+def get_gemini_llm():
+    """Return the Gemini LLM used by the analysis agents."""
+    return _singleton("gemini_llm", lambda: LLM(model="gemini/gemini-2.0-flash", api_key=GEMINI_API_KEY, temperature=0.7))
+
+def stream_completion(llm, messages, call_site="stream", attrs=None):
+    """Yield the text chunks of a chat completion as the model produces them.
+
+    Goes straight to litellm (which CrewAI uses underneath) with the same model settings
+    as `llm`, because a Crew only returns once the whole answer is generated.
+    """
+    import litellm
+
+    rate_limit("gemini")
+    response = litellm.completion(model=llm.model, api_key=llm.api_key, temperature=llm.temperature,
+                                  messages=messages, stream=True, stream_options={"include_usage": True})
+    usage = None
+    for chunk in response:
+        usage = getattr(chunk, "usage", None) or usage
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            yield text
+    record_llm_call(call_site, llm.model, usage, attrs)
+
+class LazyEmbeddings:
+    """Embeddings facade that loads the model on the first embedding call."""
+
+    def embed_query(self, text):
+        return get_embeddings().embed_query(text)
 
-# Initialize Mistral LLM
-mistral_llm = LLM(model="mistral/mistral-large-latest", api_key=MISTRAL_API_KEY, temperature=0.7)
+    def embed_documents(self, texts):
+        return get_embeddings().embed_documents(texts)
 
-# Initialize Gemini LLM
-gemini_llm = LLM(model="gemini/gemini-2.0-flash", api_key=GEMINI_API_KEY, temperature=0.7)
+embeddings = LazyEmbeddings()
+
+# Embedding-based intent classifier sharing the retrieval model
+intent_classifier = IntentClassifier(embeddings)
+
+def warm_up():
+    """Load the models and connect to upstreams ahead of the first query.
+
+    Each step is independent and failures are only reported, so a Qdrant outage never
+    prevents serving. Returns {step: seconds, or the error message}.
+    """
+    timings = {}
+    steps = [
+        ("embeddings", lambda: embeddings.embed_query("warm up")),
+        ("intent_classifier", lambda: intent_classifier.classify("warm up")),
+        ("vector_index", get_vector_index),
+        ("mistral_llm", get_mistral_llm),
+        ("gemini_llm", get_gemini_llm),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+            timings[name] = time.perf_counter() - start
+        except Exception as e:
+            timings[name] = f"failed: {e}"
+    return timings
+
+def start_warm_up():
+    """Run warm_up on a daemon thread and return the thread."""
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+# Shared pool for upstream I/O issued by the task builders
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
 
 # Functions
+def fan_out(calls, prefetched=None):
+    """Run independent I/O calls concurrently, each bounded by its own deadline.
+
+    `calls` maps a name to (function, args, deadline_seconds, fallback). Returns a dict of
+    results by name; a source that raises or misses its deadline yields its fallback, so
+    the wall-clock time is that of the slowest source rather than the sum of all of them.
+    `prefetched` maps names to Futures already in flight, which are awaited instead.
+    """
+    start = time.monotonic()
+    prefetched = prefetched or {}
+    futures = {
+        name: prefetched[name] if name in prefetched else submit_in_context(io_executor, fn, *args)
+        for name, (fn, args, _, _) in calls.items()
+    }
+    results = {}
+    for name, future in futures.items():
+        _, _, deadline, fallback = calls[name]
+        try:
+            results[name] = future.result(timeout=max(0.0, start + deadline - time.monotonic()))
+        except Exception:
+            future.cancel()
+            results[name] = fallback
+    return results
+
 @lru_cache(maxsize=100)
 def search_qdrant(query, top_k=3):
-    """Search Qdrant for relevant documents."""
+    """Search the configured vector backend (Qdrant or the local index) for relevant documents."""
     try:
-        retriever = qdrant.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
-        results = retriever.invoke(query)
-        return [{"text": doc.page_content, "source": doc.metadata.get("source", "Unknown")} for doc in results]
+        return get_vector_index().search(query, top_k=top_k)
     except Exception:
         return []
 
-def search_news(query, max_results=5):
-    """Search for recent financial news using Serper API."""
-    try:
-        url = "https://google.serper.dev/search"
-        headers = {
-            "X-API-KEY": SERPER_API_KEY,
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "q": f"{query} finance news",
-            "num": max_results
+def normalize_query(query):
+    """Canonical query text: surrounding and repeated whitespace removed, case kept for tickers."""
+    return " ".join(query.split())
+
+class QueryContext:
+    """One query's normalized text, embedding and retrieved chunks, each computed at most once.
+
+    Shared by classification, speculative prefetch, retrieval and task construction within
+    a request; safe to use from the request thread and the I/O pool at the same time.
+    """
+
+    def __init__(self, query):
+        self.text = normalize_query(query)
+        self._vector = None
+        self._hits = None
+        self._hits_k = 0
+        self._vector_lock = threading.Lock()
+        self._hits_lock = threading.Lock()
+
+    @property
+    def vector(self):
+        with self._vector_lock:
+            if self._vector is None:
+                with span("embed_query"):
+                    self._vector = embeddings.embed_query(self.text)
+            return self._vector
+
+    def search(self, top_k=3):
+        """Return the top_k chunks, fetching max(top_k, RETRIEVAL_TOP_K) on first use and slicing after."""
+        with self._hits_lock:
+            reuse = self._hits is not None and top_k <= self._hits_k
+            record_cache("retrieval", reuse)
+            if not reuse:
+                self._hits_k = max(top_k, RETRIEVAL_TOP_K)
+                vector = self.vector
+                with span("retrieval", top_k=self._hits_k) as attrs:
+                    try:
+                        self._hits = get_vector_index().search(self.text, top_k=self._hits_k, vector=vector)
+                    except Exception as e:
+                        attrs["error"] = type(e).__name__
+                        return []
+                    attrs["hits"] = len(self._hits)
+            return self._hits[:top_k]
+
+def rag_is_sufficient(contexts):
+    """Whether retrieved chunks are relevant enough to answer from, judged by their scores."""
+    similarity = max((ctx.get("similarity") or 0.0 for ctx in contexts), default=0.0)
+    keyword_score = max((ctx.get("keyword_score") or 0.0 for ctx in contexts), default=0.0)
+    return similarity >= RAG_SIMILARITY_THRESHOLD or keyword_score >= RAG_KEYWORD_THRESHOLD
+
+def rag_is_confident(contexts):
+    """Whether retrieved chunks answer the query well enough that a web search adds nothing."""
+    similarity = max((ctx.get("similarity") or 0.0 for ctx in contexts), default=0.0)
+    keyword_score = max((ctx.get("keyword_score") or 0.0 for ctx in contexts), default=0.0)
+    return similarity >= WEB_SKIP_SIMILARITY_THRESHOLD or keyword_score >= WEB_SKIP_KEYWORD_THRESHOLD
+
+def _serper_request(query, max_results):
+    headers = {
+        "X-API-KEY": SERPER_API_KEY,
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "q": f"{query} finance news",
+        "num": max_results
+    }
+    return f"{SERPER_URL}/search", {"json": payload, "headers": headers, "timeout": 10}
+
+def _parse_news(data, max_results):
+    results = data.get("organic", [])
+    if not results:
+        return [{"title": "No recent news available", "url": "", "snippet": "Could not fetch news. Please try again later."}]
+    return [
+        {
+            "title": item.get("title", ""),
+            "url": item.get("link", ""),
+            "snippet": item.get("snippet", "")
         }
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        results = data.get("organic", [])
-        if not results:
-            return [{"title": "No recent news available", "url": "", "snippet": "Could not fetch news. Please try again later."}]
-
-        formatted_results = [
-            {
-                "title": item.get("title", ""),
-                "url": item.get("link", ""),
-                "snippet": item.get("snippet", "")
-            }
-            for item in results[:max_results]
-        ]
-        return formatted_results
-
-    except ConnectionError:
+        for item in results[:max_results]
+    ]
+
+def _news_error(e):
+    if isinstance(e, ConnectionError):
         return [{"title": "Connection Error", "url": "", "snippet": "Failed to connect to the news API. Please check your internet connection."}]
-    except Timeout:
+    if isinstance(e, Timeout):
         return [{"title": "Timeout Error", "url": "", "snippet": "News API request timed out. Please try again later."}]
-    except HTTPError as e:
-        if response.status_code == 429:
+    if isinstance(e, HTTPError):
+        if getattr(e.response, "status_code", None) == 429:
             return [{"title": "Rate Limit Exceeded", "url": "", "snippet": "Too many requests to the news API. Please try again later."}]
         return [{"title": "HTTP Error", "url": "", "snippet": f"Failed to fetch news due to HTTP error: {e}"}]
-    except Exception:
-        return [{"title": "Error", "url": "", "snippet": "An unexpected error occurred while fetching news. Please try again later."}]
+    return [{"title": "Error", "url": "", "snippet": "An unexpected error occurred while fetching news. Please try again later."}]
 
-def get_stock_data(symbol):
-    """Fetch stock data using Alpha Vantage API."""
+def search_news(query, max_results=5):
+    """Search for recent financial news using Serper API."""
+    with span("news_search") as attrs:
+        try:
+            url, kwargs = _serper_request(query, max_results)
+            rate_limit("serper")
+            response = get_http_client().post(url, **kwargs)
+            return _parse_news(response.json(), max_results)
+        except Exception as e:
+            attrs["error"] = type(e).__name__
+            return _news_error(e)
+
+async def async_search_news(query, max_results=5):
+    """asyncio variant of search_news sharing one connection pool per event loop."""
     try:
-        url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json().get("Global Quote", {})
-        if not data:
-            return {"symbol": symbol, "error": "No data found for this symbol."}
-        return {
-            "symbol": symbol,
-            "price": data.get("05. price", "N/A"),
-            "change": data.get("09. change", "N/A"),
-            "change_percent": data.get("10. change percent", "N/A")
-        }
-    except ConnectionError:
+        url, kwargs = _serper_request(query, max_results)
+        await asyncio.to_thread(rate_limit, "serper")
+        response = await get_async_http_client().post(url, **kwargs)
+        return _parse_news(response.json(), max_results)
+    except Exception as e:
+        return _news_error(e)
+
+RATE_LIMIT_ERROR = "Too many requests to the stock API. Please try again later."
+
+def _quote_request(symbol):
+    params = {"function": "GLOBAL_QUOTE", "symbol": symbol, "apikey": ALPHA_VANTAGE_API_KEY}
+    return f"{ALPHA_VANTAGE_URL}/query", {"params": params, "timeout": 10}
+
+def _parse_quote(symbol, payload):
+    # Alpha Vantage reports an exhausted quota with HTTP 200 and a Note/Information message
+    if not payload.get("Global Quote") and ("Note" in payload or "Information" in payload):
+        return {"symbol": symbol, "error": RATE_LIMIT_ERROR, "rate_limited": True}
+    data = payload.get("Global Quote", {})
+    if not data:
+        return {"symbol": symbol, "error": "No data found for this symbol."}
+    return {
+        "symbol": symbol,
+        "price": data.get("05. price", "N/A"),
+        "change": data.get("09. change", "N/A"),
+        "change_percent": data.get("10. change percent", "N/A")
+    }
+
+def _stock_error(symbol, e):
+    if isinstance(e, ConnectionError):
         return {"symbol": symbol, "error": "Failed to connect to the stock API. Please check your internet connection."}
-    except Timeout:
+    if isinstance(e, Timeout):
         return {"symbol": symbol, "error": "Stock API request timed out. Please try again later."}
-    except HTTPError as e:
-        if response.status_code == 429:
-            return {"symbol": symbol, "error": "Too many requests to the stock API. Please try again later."}
+    if isinstance(e, HTTPError):
+        if getattr(e.response, "status_code", None) == 429:
+            return {"symbol": symbol, "error": RATE_LIMIT_ERROR, "rate_limited": True}
         return {"symbol": symbol, "error": f"Failed to fetch stock data due to HTTP error: {e}"}
-    except Exception:
-        return {"symbol": symbol, "error": "An unexpected error occurred while fetching stock data. Please try again later."}
+    return {"symbol": symbol, "error": "An unexpected error occurred while fetching stock data. Please try again later."}
 
-@lru_cache(maxsize=100)
-def determine_question_type(query):
-    """Determine the type of user query using Mistral LLM via CrewAI's task mechanism."""
-    classifier_agent = Agent(
+def get_stock_data(symbol):
+    """Fetch stock data using Alpha Vantage API."""
+    with span("stock_quote", symbol=symbol) as attrs:
+        try:
+            url, kwargs = _quote_request(symbol)
+            response = get_http_client().get(url, **kwargs)
+            return _parse_quote(symbol, response.json())
+        except Exception as e:
+            attrs["error"] = type(e).__name__
+            return _stock_error(symbol, e)
+
+def _history_request(symbol):
+    params = {"function": "TIME_SERIES_DAILY", "symbol": symbol, "outputsize": "compact", "apikey": ALPHA_VANTAGE_API_KEY}
+    return f"{ALPHA_VANTAGE_URL}/query", {"params": params, "timeout": 10}
+
+def _parse_history(symbol, payload):
+    if not payload.get("Time Series (Daily)") and ("Note" in payload or "Information" in payload):
+        return {"symbol": symbol, "error": RATE_LIMIT_ERROR, "rate_limited": True}
+    series = payload.get("Time Series (Daily)", {})
+    if not series:
+        return {"symbol": symbol, "error": "No daily history found for this symbol.", "not_found": True}
+    dates = sorted(series)
+    return {
+        "symbol": symbol,
+        "dates": dates,
+        "closes": np.array([float(series[date]["4. close"]) for date in dates]),
+    }
+
+def get_daily_history(symbol):
+    """Fetch about 100 sessions of daily closes (oldest first) from Alpha Vantage."""
+    with span("stock_history", symbol=symbol) as attrs:
+        try:
+            url, kwargs = _history_request(symbol)
+            response = get_http_client().get(url, **kwargs)
+            return _parse_history(symbol, response.json())
+        except Exception as e:
+            attrs["error"] = type(e).__name__
+            return _stock_error(symbol, e)
+
+async def async_get_stock_data(symbol):
+    """asyncio variant of get_stock_data sharing one connection pool per event loop."""
+    try:
+        url, kwargs = _quote_request(symbol)
+        response = await get_async_http_client().get(url, **kwargs)
+        return _parse_quote(symbol, response.json())
+    except Exception as e:
+        return _stock_error(symbol, e)
+
+# Query classification
+CATEGORIES = ["finance_knowledge", "market_news", "stock_analysis"]
+
+TICKER_PATTERN = re.compile(r"\$([A-Z]{1,5})\b|(?<![\w/&])([A-Z]{1,5}(?:\.[A-Z])?)(?![\w/&])")
+# Explicit request to compare several stocks ("compare AAPL and MSFT", "$KO vs $PEP")
+COMPARE_PATTERN = re.compile(r"\b(?:compare|comparing|comparison|versus|vs)\b", re.IGNORECASE)
+STOCK_KEYWORDS = ("analyze", "analyse", "analysis", "stock", "stocks", "share", "shares", "ticker", "price", "quote", "performance",
+                  "compare", "versus")
+NEWS_KEYWORDS = ("news", "latest", "headline", "headlines", "today", "this week", "breaking", "recent")
+KNOWLEDGE_PREFIXES = ("what is", "what's", "what are", "explain", "define", "definition of", "meaning of", "how does", "how do", "difference between")
+# Upper-case words and finance acronyms that must never be mistaken for tickers
+NON_TICKER_WORDS = {
+    "A", "I", "AN", "AND", "OR", "THE", "OF", "IS", "IN", "ON", "TO", "FOR", "ME", "MY", "US", "USA", "UK", "EU",
+    "OK", "NOW", "IT", "ALL", "BUY", "SELL", "HOLD", "STOCK", "STOCKS", "NEWS", "WHAT", "HOW", "WHY", "VS",
+    "PE", "EPS", "ETF", "ETFS", "IPO", "CEO", "CFO", "GDP", "CPI", "ROI", "ROE", "ROA", "EBIT", "EBITDA", "NAV",
+    "APR", "APY", "FX", "FED", "SEC", "IRA", "LLC", "PLC", "AI", "BOP", "NPV", "IRR", "WACC", "CAPM", "DCF", "M", "B",
+    "OTC", "YTD", "QTD", "MTD", "YOY", "QOQ", "TTM", "FCF", "NYSE", "AMEX", "FOMC", "ECB", "IMF", "FDIC", "REIT",
+    "REITS", "SPAC", "ADR", "ESG", "AUM", "ATH", "LBO", "PPI", "PMI", "GAAP", "IFRS", "COGS", "SGA", "CAGR", "DRIP",
+}
+GLOSSARY_TERMS = (
+    "asset", "liability", "equity", "revenue", "profit", "margin", "dividend", "bond", "yield", "coupon",
+    "interest rate", "inflation", "deflation", "balance sheet", "income statement", "cash flow", "balance of payments",
+    "p/e", "pe ratio", "price to earnings", "earnings per share", "eps", "ebitda", "liquidity", "solvency",
+    "leverage", "depreciation", "amortization", "capital", "working capital", "diversification", "portfolio",
+    "bull market", "bear market", "mutual fund", "etf", "index fund", "hedge", "derivative", "option", "futures",
+    "compound interest", "annuity", "mortgage", "credit", "debt", "ratio", "return on", "valuation", "investing",
+    "investment", "stock market", "market capitalization", "gdp", "fiscal", "monetary policy", "budget", "savings",
+)
+# Glossary words with common everyday meanings ("capital of France", "best option for dinner");
+# they only count as finance terms next to another finance or market term
+AMBIGUOUS_GLOSSARY_TERMS = frozenset((
+    "capital", "option", "savings", "credit", "hedge", "margin", "yield", "budget", "derivative", "futures",
+    "portfolio", "equity", "leverage", "coupon", "ratio", "debt", "asset", "liability", "return on",
+))
+# Words that put a news query in a market context ("latest cryptocurrency market news")
+MARKET_TERMS = (
+    "market", "markets", "stock", "stocks", "share", "shares", "crypto", "cryptocurrency", "bitcoin", "bond", "bonds",
+    "fed", "federal reserve", "interest rate", "interest rates", "rates", "inflation", "earnings", "economy", "economic",
+    "oil", "gold", "nasdaq", "dow", "s&p", "treasury", "treasuries", "forex", "currency", "currencies", "bank", "banks",
+    "banking", "ipo", "sector", "investor", "investors", "trading", "recession", "gdp", "cpi", "jobs report", "finance",
+    "financial", "wall street", "commodities", "etf", "etfs", "dividend", "dividends", "mortgage", "mortgages",
+)
+
+def _term_pattern(terms):
+    """Match any of `terms` as whole words, allowing a plural "s"."""
+    alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(rf"(?<![\w/&])(?:{alternatives})s?(?![\w/&])")
+
+_GLOSSARY_PATTERN = _term_pattern(GLOSSARY_TERMS)
+_MARKET_PATTERN = _term_pattern(MARKET_TERMS)
+
+def _finance_terms(text):
+    """Glossary terms in the text, dropping ambiguous ones that have no other finance term beside them."""
+    terms = set()
+    for match in _GLOSSARY_PATTERN.finditer(text):
+        term = match.group(0)
+        terms.add(term[:-1] if term not in GLOSSARY_TERMS else term)
+    if terms - AMBIGUOUS_GLOSSARY_TERMS or len(terms) > 1 or _MARKET_PATTERN.search(text):
+        return terms
+    return set()
+
+# How often each classifier tier produced the final answer
+# ("cached": an LLM answer reused from classify_with_llm's in-process cache)
+_classifier_stats = {"rules": 0, "embedding": 0, "cached": 0, "combined_llm": 0, "legacy_llm": 0, "default": 0}
+_classifier_stats_lock = threading.Lock()
+_classifier_local = threading.local()
+
+def _record_tier(tier):
+    with _classifier_stats_lock:
+        _classifier_stats[tier] += 1
+    trace = current_trace()
+    if trace is not None:
+        trace.flags["classifier_tier"] = tier
+
+def get_classifier_stats():
+    """Return per-tier counts and hit rates, plus how many LLM round trips the tiers avoided.
+
+    The baseline is the original classifier's two Mistral calls per query; a query that
+    falls through to the two-step prompts costs three (the failed combined call included).
+    """
+    with _classifier_stats_lock:
+        counts = dict(_classifier_stats)
+    total = sum(counts.values())
+    llm_calls = counts["combined_llm"] + 3 * (counts["legacy_llm"] + counts["default"])
+    return {
+        "total": total,
+        "counts": counts,
+        "hit_rates": {tier: (count / total if total else 0.0) for tier, count in counts.items()},
+        "llm_calls": llm_calls,
+        "llm_calls_avoided": 2 * total - llm_calls,
+    }
+
+def extract_tickers(query):
+    """Return upper-case ticker-like tokens in the query, ignoring common finance acronyms."""
+    tickers = []
+    for match in TICKER_PATTERN.finditer(query):
+        symbol = match.group(1) or match.group(2)
+        if match.group(1) or symbol not in NON_TICKER_WORDS:
+            if symbol not in tickers:
+                tickers.append(symbol)
+    return tickers
+
+def comparison_symbols(query, symbol):
+    """Symbols to compare for an explicit comparison query, starting with the classified `symbol`.
+
+    Returns [symbol] unless the query asks for a comparison. Other candidates must be
+    $-prefixed or at least two letters long; upper-case words that are not listed symbols
+    are dropped later, when their daily history comes back empty.
+    """
+    if not COMPARE_PATTERN.search(query):
+        return [symbol]
+    symbols = [symbol]
+    for match in TICKER_PATTERN.finditer(query):
+        candidate = match.group(1) or match.group(2)
+        if candidate in symbols or not (match.group(1) or (len(candidate) > 1 and candidate not in NON_TICKER_WORDS)):
+            continue
+        symbols.append(candidate)
+    return symbols
+
+def classify_by_rules(query):
+    """Cheap deterministic classification; returns (category, extra_data) or None when unsure."""
+    text = query.lower()
+    tickers = extract_tickers(query)
+    # Only "$AAPL" is unambiguous; a bare upper-case word ("OTC", "YTD", "NOW") is left to
+    # the embedding and LLM tiers, which can tell a ticker from an acronym
+    dollar_tickers = [match.group(1) for match in TICKER_PATTERN.finditer(query) if match.group(1)]
+    has_stock_keyword = any(re.search(rf"\b{re.escape(keyword)}\b", text) for keyword in STOCK_KEYWORDS)
+    has_news_keyword = any(re.search(rf"\b{re.escape(keyword)}\b", text) for keyword in NEWS_KEYWORDS)
+
+    if dollar_tickers and (has_stock_keyword or not has_news_keyword):
+        return "stock_analysis", dollar_tickers[0]
+    if text.startswith(KNOWLEDGE_PREFIXES) and _finance_terms(text):
+        return "finance_knowledge", query
+    if tickers:
+        return None
+    # "today" or "latest" alone ("What's the weather today?") is not market news
+    if has_news_keyword and (_MARKET_PATTERN.search(text) or _finance_terms(text)):
+        return "market_news", query
+    return None
+
+def classify_by_embedding(query, threshold=INTENT_CONFIDENCE_THRESHOLD, vector=None):
+    """kNN intent classification on the query embedding; returns None when confidence is low."""
+    if vector is None:
+        vector = embeddings.embed_query(query)
+    label, confidence = intent_classifier.classify_vector(vector)
+    if confidence < threshold:
+        return None
+    if label == "out_of_scope":
+        return "out_of_scope", "This query is out of scope for a finance assistant."
+    if label == "stock_analysis":
+        tickers = extract_tickers(query)
+        # Without a recognisable ticker the LLM has to name the stock
+        return ("stock_analysis", tickers[0]) if tickers else None
+    return label, query
+
+def _run_classifier_prompt(classifier_agent, prompt, expected_output):
+    """Run one classification prompt on a throwaway crew and return the raw text.
+
+    Identical prompts are answered from the persistent LLM cache across restarts.
+    """
+    task = Task(description=prompt, agent=classifier_agent, expected_output=expected_output)
+    llm = classifier_agent.llm
+    cache_key = task_prompt(task)
+    if llm_cache is not None:
+        cached = llm_cache.get("classifier", llm.model, llm.temperature, cache_key)
+        if cached is not None:
+            return cached
+    temp_crew = Crew(
+        agents=[classifier_agent],
+        tasks=[task],
+        process=Process.sequential,
+        verbose=False
+    )
+    rate_limit("mistral")
+    with span("classifier_llm") as attrs:
+        response = temp_crew.kickoff()
+        record_llm_call("classifier", llm.model, getattr(response, "token_usage", None), attrs)
+    response_text = response.raw if hasattr(response, 'raw') else str(response)
+    if llm_cache is not None:
+        llm_cache.put("classifier", llm.model, llm.temperature, cache_key, response_text)
+    return response_text
+
+def _parse_field(response_text, field):
+    """Find 'Field: value' anywhere in an LLM response."""
+    for line in response_text.strip().split("\n"):
+        line = line.strip().strip("*").strip()
+        if line.lower().startswith(field.lower() + ":"):
+            return line[len(field) + 1:].strip().strip("*").strip()
+    return None
+
+def _create_classifier_agent():
+    return Agent(
         role="Query Classifier",
         goal="Classify user queries into appropriate categories, including detecting out-of-scope queries.",
         backstory="An expert in natural language understanding, capable of analyzing queries and categorizing them accurately.",
-        llm=mistral_llm,
+        llm=get_mistral_llm(),
         verbose=True,
         allow_delegation=False
     )
 
+def classify_combined(query, classifier_agent):
+    """Single LLM round trip returning scope, category and extra data together."""
+    prompt = f"""
+    Analyze the following user query and classify it:
+    - Is Finance Related: 'Yes' if the query is about financial terms, concepts, strategies, market news, or stock analysis (e.g., banking, stocks, revenue, P/E ratio); 'No' otherwise (e.g., cooking recipes, weather).
+    - Category (only if finance related):
+      - finance_knowledge: General questions about financial terms, concepts, or strategies (e.g., 'What is revenue?', 'Explain P/E ratio')
+      - market_news: Questions about current market news, trends, or events (e.g., 'Latest news about cryptocurrency market')
+      - stock_analysis: Questions about specific stock analysis (e.g., mentioning a stock ticker like AAPL, 'Analyze META stock performance')
+      - Use 'none' if the query is not finance related.
+
+    Query: "{query}"
+
+    Provide your response in exactly this format:
+    Is Finance Related: <Yes/No>
+    Category: <category>
+    Extra Data: <additional info, such as the stock ticker for stock_analysis, or the query itself>
+    """
+    response_text = _run_classifier_prompt(
+        classifier_agent, prompt,
+        "A classification in the format: Is Finance Related: <Yes/No>\nCategory: <category>\nExtra Data: <additional info>"
+    )
+    is_finance_related = _parse_field(response_text, "Is Finance Related")
+    if is_finance_related is None:
+        raise ValueError("Invalid response format from LLM for combined classification")
+    if is_finance_related.lower() != "yes":
+        return "out_of_scope", "This query is out of scope for a finance assistant."
+    category = _parse_field(response_text, "Category")
+    if category not in CATEGORIES:
+        raise ValueError(f"Invalid category: {category}")
+    extra_data = _parse_field(response_text, "Extra Data") or query
+    return category, extra_data
+
+def classify_legacy(query, classifier_agent):
+    """Original two-step classification: finance check, then category."""
     # Check if the query is finance-related
     finance_check_prompt = f"""
     Analyze the following user query and determine if it is related to finance:
@@ -139,35 +680,23 @@ def determine_question_type(query):
     Provide your response in this format:
     Is Finance Related: <Yes/No>
     """
-
-    finance_check_task = Task(
-        description=finance_check_prompt,
-        agent=classifier_agent,
-        expected_output="A classification in the format: Is Finance Related: <Yes/No>"
-    )
-
-    temp_crew = Crew(
-        agents=[classifier_agent],
-        tasks=[finance_check_task],
-        process=Process.sequential,
-        verbose=False
-    )
-
     try:
-        response = temp_crew.kickoff()
-        response_text = response.raw if hasattr(response, 'raw') else str(response)
-        lines = response_text.strip().split("\n")
-        if len(lines) < 1 or "Is Finance Related:" not in lines[0]:
+        response_text = _run_classifier_prompt(
+            classifier_agent, finance_check_prompt,
+            "A classification in the format: Is Finance Related: <Yes/No>"
+        )
+        is_finance_related = _parse_field(response_text, "Is Finance Related")
+        if is_finance_related is None:
             raise ValueError("Invalid response format from LLM for finance check")
-        is_finance_related = lines[0].replace("Is Finance Related: ", "").strip().lower() == "yes"
-    except Exception as e:
+        is_finance_related = is_finance_related.lower() == "yes"
+    except Exception:
         # Fallback to default behavior if classification fails
         is_finance_related = False
 
     if not is_finance_related:
         return "out_of_scope", "This query is out of scope for a finance assistant."
 
-    #If finance-related, classify the query type
+    # If finance-related, classify the query type
     classification_prompt = f"""
     Analyze the following user query and determine its category:
     - finance_knowledge: General questions about financial terms, concepts, or strategies (e.g., 'What is revenue?', 'Explain P/E ratio')
@@ -180,30 +709,66 @@ def determine_question_type(query):
     Category: <category>
     Extra Data: <additional info, such as the stock ticker for stock_analysis, or the query itself>
     """
-
-    classifier_task = Task(
-        description=classification_prompt,
-        agent=classifier_agent,
-        expected_output="A classification of the query in the format: Category: <category>\nExtra Data: <additional info>"
+    response_text = _run_classifier_prompt(
+        classifier_agent, classification_prompt,
+        "A classification of the query in the format: Category: <category>\nExtra Data: <additional info>"
     )
+    category = _parse_field(response_text, "Category")
+    if category not in CATEGORIES:
+        raise ValueError(f"Invalid category: {category}")
+    return category, _parse_field(response_text, "Extra Data") or query
 
-    temp_crew = Crew(
-        agents=[classifier_agent],
-        tasks=[classifier_task],
-        process=Process.sequential,
-        verbose=False
-    )
+def determine_question_type(query, context=None):
+    """Classify a query, trying local rules, then embedding kNN, then one combined Mistral call,
+    then the two-step prompts.
+
+    With a QueryContext the embedding tier reuses the request's query embedding.
+    """
+    with span("classify"):
+        question_type, extra_data = _determine_question_type(query, context)
+        set_question_type(question_type)
+    return question_type, extra_data
+
+def _determine_question_type(query, context):
+    result = classify_by_rules(query)
+    if result is not None:
+        _record_tier("rules")
+        return result
 
     try:
-        response = temp_crew.kickoff()
-        response_text = response.raw if hasattr(response, 'raw') else str(response)
-        lines = response_text.strip().split("\n")
-        if len(lines) < 2:
-            raise ValueError("Invalid response format from LLM for category classification")
-        category_line = lines[0].replace("Category: ", "").strip()
-        extra_data_line = lines[1].replace("Extra Data: ", "").strip()
-        if category_line not in ["finance_knowledge", "market_news", "stock_analysis"]:
-            raise ValueError(f"Invalid category: {category_line}")
-        return category_line, extra_data_line
+        result = classify_by_embedding(query, vector=context.vector if context is not None else None)
+    except Exception:
+        result = None
+    if result is not None:
+        _record_tier("embedding")
+        return result
+    return classify_with_llm(query)
+
+def classify_with_llm(query):
+    """The Mistral tiers of determine_question_type, cached per query text.
+
+    Every call records a tier; a repeat served from the cache counts as "cached".
+    """
+    _classifier_local.tier = "cached"
+    result = _classify_with_llm(query)
+    _record_tier(_classifier_local.tier)
+    return result
+
+@lru_cache(maxsize=100)
+def _classify_with_llm(query):
+    # Runs on the caller's thread only on a cache miss, so the tier it sets belongs to this call
+    classifier_agent = _create_classifier_agent()
+    try:
+        result = classify_combined(query, classifier_agent)
+        _classifier_local.tier = "combined_llm"
+        return result
+    except Exception:
+        pass
+
+    try:
+        result = classify_legacy(query, classifier_agent)
+        _classifier_local.tier = "legacy_llm"
+        return result
     except Exception:
-        return "finance_knowledge", query
\ No newline at end of file
+        _classifier_local.tier = "default"
+        return "finance_knowledge", query
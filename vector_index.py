@@ -0,0 +1,137 @@
+# vector_index.py
+
+import json
+import os
+import numpy as np
+from intent import normalize_rows
+
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "chunks.json"
+
+class QdrantIndex:
+    """Search backend over the hosted Qdrant collection."""
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+
+    def search(self, query, top_k=3, vector=None):
+        """Return the top_k chunks as dicts with id, text, source and similarity score.
+
+        Pass the query's `vector` if it is already embedded to skip embedding it again.
+        """
+        if vector is None:
+            results = self.vector_store.similarity_search_with_score(query, k=top_k)
+        else:
+            results = self.vector_store.similarity_search_with_score_by_vector(vector, k=top_k)
+        return [
+            {"id": doc.metadata.get("_id"), "text": doc.page_content, "source": doc.metadata.get("source", "Unknown"),
+             "score": float(score), "similarity": float(score)}
+            for doc, score in results
+        ]
+
+class LocalVectorIndex:
+    """In-process search backend: a memory-mapped float32 matrix of normalised chunk
+    embeddings plus a JSON sidecar holding each row's text and source.
+
+    Search is one matrix-vector product, so the three PDFs in Data/ are searched in well
+    under a millisecond once the query is embedded, with no network access.
+    """
+
+    def __init__(self, path, embeddings):
+        self.path = path
+        self.embeddings = embeddings
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+            self.chunks = json.load(f)
+        if len(self.chunks) != self.vectors.shape[0]:
+            raise ValueError(f"Local index at {path} is inconsistent: {self.vectors.shape[0]} vectors, {len(self.chunks)} chunks")
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, top_k=3, vector=None):
+        """Return the top_k chunks as dicts with id, text, source and similarity score."""
+        if vector is None:
+            vector = self.embeddings.embed_query(query)
+        return self.search_by_vector(vector, top_k=top_k)
+
+    def search_by_vector(self, vector, top_k=3):
+        if not len(self.chunks):
+            return []
+        scores = self.vectors @ normalize_rows(vector).ravel()
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.chunks[i].get("id"), "text": self.chunks[i]["text"], "source": self.chunks[i]["source"],
+             "score": float(scores[i]), "similarity": float(scores[i])}
+            for i in top
+        ]
+
+    @staticmethod
+    def write(path, vectors, chunks):
+        """Atomically write a normalised embedding matrix and its chunk metadata to `path`."""
+        os.makedirs(path, exist_ok=True)
+        vectors = normalize_rows(vectors) if len(chunks) else np.zeros((0, 0), dtype=np.float32)
+        tmp_vectors = os.path.join(path, VECTORS_FILE + ".tmp")
+        tmp_metadata = os.path.join(path, METADATA_FILE + ".tmp")
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, vectors)
+        with open(tmp_metadata, "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+        os.replace(tmp_vectors, os.path.join(path, VECTORS_FILE))
+        os.replace(tmp_metadata, os.path.join(path, METADATA_FILE))
+
+    @classmethod
+    def build(cls, path, texts, sources, embeddings, ids=None, batch_size=256):
+        """Embed `texts` in batches, write the index to `path` and open it.
+
+        Pass the chunk `ids` used by the BM25 index over the same chunks, so hybrid search
+        fuses each chunk's two hits into one.
+        """
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+        chunks = [{"text": text, "source": source} for text, source in zip(texts, sources)]
+        if ids is not None:
+            for chunk, chunk_id in zip(chunks, ids):
+                chunk["id"] = chunk_id
+        cls.write(path, np.asarray(vectors, dtype=np.float32), chunks)
+        return cls(path, embeddings)
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge ranked hit lists by summing 1 / (k + rank) per chunk.
+
+    Chunks are matched by id (text when there is none), and the fused hit keeps every
+    score the individual retrievers reported, e.g. "similarity" and "keyword_score".
+    """
+    fused = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            key = hit.get("id") or hit["text"]
+            entry = fused.setdefault(key, {"id": hit.get("id"), "text": hit["text"], "source": hit["source"], "score": 0.0})
+            entry["score"] += 1.0 / (k + rank)
+            for field in ("similarity", "keyword_score"):
+                if field in hit:
+                    entry[field] = hit[field]
+    return sorted(fused.values(), key=lambda hit: -hit["score"])
+
+class HybridIndex:
+    """Vector search plus BM25 over the same chunks, merged with reciprocal-rank fusion.
+
+    Each retriever contributes `candidates` hits so that a chunk ranked moderately by both
+    can overtake one ranked highly by only one of them.
+    """
+
+    def __init__(self, vector_index, bm25, candidates=10):
+        self.vector_index = vector_index
+        self.bm25 = bm25
+        self.candidates = candidates
+
+    def search(self, query, top_k=3, vector=None):
+        """Return the top_k fused chunks; "score" is the fusion score."""
+        depth = max(top_k, self.candidates)
+        return reciprocal_rank_fusion([
+            self.vector_index.search(query, top_k=depth, vector=vector),
+            self.bm25.search(query, top_k=depth),
+        ])[:top_k]